@@ -0,0 +1,131 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+from nmmo.core.snapshot import RealmSnapshot, shared_objects
+
+"""
+On-disk checkpoints of an Env, to save and resume a persistent world.
+
+A checkpoint is a directory holding:
+  manifest.json  format version, tick, map id and the table layout
+  <table>.npy    the rows of each datastore table, as raw arrays
+  map.npy        the base material of each tile
+  state.pkl      everything else captured by Env.snapshot()
+
+The tables dominate the size of a world and are stored as plain .npy
+files, which load memory-mapped. The Python-side game objects are
+pickled, but the realm, config, datastore, map and helpers they point
+to are written as references and bound to the loading Env instead.
+Tiles are rebuilt from their table rows and the base materials, so
+loading does not depend on the map files of the loading Env.
+"""
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+STATE = 'state.pkl'
+MAP = 'map.npy'
+
+class _Pickler(pickle.Pickler):
+  def __init__(self, file, shared):
+    super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+    self._shared = {id(obj): name for name, obj in shared.items()}
+
+  def persistent_id(self, obj):
+    return self._shared.get(id(obj))
+
+class _Unpickler(pickle.Unpickler):
+  def __init__(self, file, shared):
+    super().__init__(file)
+    self._shared = shared
+
+  def persistent_load(self, pid):
+    return self._shared[pid]
+
+def write_checkpoint(path: str, realm, snapshot):
+  '''Writes an Env.snapshot() of realm to the directory path
+
+  The directory is replaced as a whole, so an interrupted write
+  leaves the previous checkpoint intact'''
+  path = os.path.abspath(path)
+  parent = os.path.dirname(path)
+  os.makedirs(parent, exist_ok=True)
+  tmp = tempfile.mkdtemp(dir=parent, prefix='.checkpoint_')
+
+  world = snapshot.realm
+  tables = {}
+  for name, (data, *_) in world.tables.items():
+    np.save(os.path.join(tmp, f'{name}.npy'), data)
+    tables[name] = {
+      'file': f'{name}.npy', 'shape': list(data.shape), 'dtype': data.dtype.str}
+  np.save(os.path.join(tmp, MAP), realm.map.materials)
+
+  state = {
+    'tables': {name: meta for name, (_, *meta) in world.tables.items()},
+    'objects': world.objects,
+    'tiles': world.tiles,
+    'respawns': world.respawns,
+    'dead_agents': snapshot.dead_agents,
+    'scripted_agents': snapshot.scripted_agents,
+    'np_random': snapshot.np_random,
+    'random': snapshot.random,
+  }
+  with open(os.path.join(tmp, STATE), 'wb') as f:
+    _Pickler(f, shared_objects(realm)).dump(state)
+
+  manifest = {
+    'version': FORMAT_VERSION,
+    'tick': world.tick,
+    'map_id': world.map_id,
+    'item_instance_id': world.item_instance_id,
+    'tables': tables,
+  }
+  with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+    json.dump(manifest, f, indent=2)
+
+  if os.path.exists(path):
+    old = tempfile.mkdtemp(dir=parent, prefix='.checkpoint_old_')
+    os.rename(path, os.path.join(old, 'checkpoint'))
+    os.rename(tmp, path)
+    shutil.rmtree(old)
+  else:
+    os.rename(tmp, path)
+
+def read_checkpoint(path: str, realm):
+  '''Reads a checkpoint into the form of Env.snapshot(), bound to realm'''
+  with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+    manifest = json.load(f)
+  assert manifest['version'] == FORMAT_VERSION, \
+    f'Unsupported checkpoint version {manifest["version"]}'
+
+  with open(os.path.join(path, STATE), 'rb') as f:
+    state = _Unpickler(f, shared_objects(realm)).load()
+
+  tables = {}
+  for name, layout in manifest['tables'].items():
+    data = np.load(os.path.join(path, layout['file']), mmap_mode='r')
+    assert list(data.shape) == layout['shape'] and data.dtype.str == layout['dtype'], \
+      f'Table {name} does not match the manifest'
+    tables[name] = (data, *state['tables'][name])
+
+  world = RealmSnapshot(
+    map_id=manifest['map_id'],
+    tick=manifest['tick'],
+    item_instance_id=manifest['item_instance_id'],
+    tables=tables,
+    objects=state['objects'],
+    tiles=state['tiles'],
+    respawns=state.get('respawns'),
+    map_materials=np.load(os.path.join(path, MAP)))
+
+  return SimpleNamespace(
+    realm=world,
+    dead_agents=state['dead_agents'],
+    scripted_agents=state['scripted_agents'],
+    np_random=state['np_random'],
+    random=state['random'])
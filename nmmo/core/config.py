@@ -154,6 +154,15 @@ class Config(Template):
   PROVIDE_ACTION_TARGETS       = False
   '''Flag used to provide action targets mask'''
 
+  PROVIDE_OBS_BUFFERS          = False
+  '''Flag used to write observations into buffers owned by the env, valid until the next step'''
+
+  PROVIDE_LAZY_OBS             = False
+  '''Flag used to convert the observation of an agent to gym arrays on first access'''
+
+  PROVIDE_LAZY_OBS_QUERIES     = False
+  '''Flag used with PROVIDE_LAZY_OBS to also query the observation of an agent on first access'''
+
   PLAYERS                      = [Agent]
   '''Player classes from which to spawn'''
 
@@ -275,9 +284,24 @@ class Config(Template):
   MAP_GENERATOR                = MapGenerator
   '''Specifies a user map generator. Uses default generator if unspecified.'''
 
+  MAP_TILE_VIEWS               = False
+  '''Whether tiles live in numpy grids and are viewed on demand, to save memory on large maps'''
+
+  MAP_SCHEDULE_RESPAWNS        = False
+  '''Whether to sample the respawn tick of a tile on depletion, instead of drawing every tick'''
+
   MAP_FORCE_GENERATION         = True
   '''Whether to regenerate and overwrite existing maps'''
 
+  MAP_GENERATION_WORKERS       = 1
+  '''Number of processes that generate maps in parallel'''
+
+  MAP_GENERATION_START_METHOD  = None
+  '''Start method of the map generation processes, e.g. 'spawn'; None uses the platform default'''
+
+  MAP_CACHE                    = False
+  '''Whether to reuse maps from a cache keyed by their config, ignoring MAP_FORCE_GENERATION'''
+
   MAP_GENERATE_PREVIEWS        = False
   '''Whether map generation should also save .png previews (slow + large file size)'''
 
@@ -285,6 +309,30 @@ class Config(Template):
   '''Downscaling factor for png previews'''
 
 
+  ############################################################################
+  ### Datastore Parameters
+  DATASTORE_SPATIAL_INDEX      = False
+  '''Whether to bucket Entity and Tile rows by position to speed up window queries'''
+
+  DATASTORE_TILE_GRID          = True
+  '''Whether to lay out the Tile table as a MAP_SIZE x MAP_SIZE grid, so windows are slices'''
+
+  DATASTORE_ITEM_OWNER_INDEX   = True
+  '''Whether to index Item rows by owner_id to speed up inventory queries'''
+
+  DATASTORE_COMPACT_DTYPES     = True
+  '''Whether to store tables in the integer dtypes of their schemas instead of float32'''
+
+  DATASTORE_DIRTY_TRACKING     = False
+  '''Whether tables record the rows and columns changed since the start of the last step'''
+
+  DATASTORE_COMPACT_ROWS       = False
+  '''Whether Entity and Item tables fill the lowest free row first, so queries skip free rows'''
+
+  DATASTORE_SHARED_MEMORY      = False
+  '''Whether tables live in shared memory, readable by name via SharedDatastoreReader'''
+
+
   ############################################################################
   ### Path Parameters
   PATH_ROOT                = os.path.dirname(nmmo.__file__)
@@ -1,5 +1,6 @@
 import functools
 import random
+from types import SimpleNamespace
 from typing import Any, Dict, List
 from ordered_set import OrderedSet
 
@@ -9,11 +10,14 @@ from pettingzoo.utils.env import AgentID, ParallelEnv
 
 import nmmo
 from nmmo.core.config import Default
-from nmmo.core.observation import Observation
+from nmmo.core.observation import (LazyObservationDict, Observation, ObsBuffers,
+                                   make_action_targets_batch)
 from nmmo.core.tile import Tile
 from nmmo.entity.entity import Entity
 from nmmo.systems.item import Item
 from nmmo.core import realm
+from nmmo.core.checkpoint import read_checkpoint, write_checkpoint
+from nmmo.lib import utils
 from scripted.baselines import Scripted
 
 
@@ -33,13 +37,14 @@ class Env(ParallelEnv):
     self.config = config
     self.realm = realm.Realm(config)
     self.obs = None
+    self._obs_generation = 0
+    self._obs_buffers = ObsBuffers(config) if config.PROVIDE_OBS_BUFFERS else None
 
     self.possible_agents = list(range(1, config.PLAYER_N + 1))
     self._dead_agents = OrderedSet()
     self.scripted_agents = OrderedSet()
 
-  # pylint: disable=method-cache-max-size-none
-  @functools.lru_cache(maxsize=None)
+  @utils.memoize
   def observation_space(self, agent: int):
     '''Neural MMO Observation Space
 
@@ -80,7 +85,7 @@ class Env(ParallelEnv):
       np.random.seed(seed)
       random.seed(seed)
 
-  @functools.lru_cache(maxsize=None)
+  @utils.memoize
   def action_space(self, agent):
     '''Neural MMO Action Space
 
@@ -145,7 +150,7 @@ class Env(ParallelEnv):
 
     self.obs = self._compute_observations()
 
-    return {a: o.to_gym() for a,o in self.obs.items()}
+    return self._gym_observations()
 
   def step(self, actions: Dict[int, Dict[str, Dict[str, Any]]]):
     '''Simulates one game tick or timestep
@@ -260,12 +265,63 @@ class Env(ParallelEnv):
 
     # Store the observations, since actions reference them
     self.obs = self._compute_observations()
-    gym_obs = {a: o.to_gym() for a,o in self.obs.items()}
+    gym_obs = self._gym_observations()
 
     rewards, infos = self._compute_rewards(self.obs.keys(), dones)
 
     return gym_obs, rewards, dones, infos
 
+  def snapshot(self):
+    '''Captures the full simulation state, to branch or roll back with restore()
+
+    Covers the datastore tables, entities, items, exchange listings, map,
+    tick and the global RNG states. Logs and replays are not captured.
+
+    Returns:
+        snapshot: Opaque state that restore() accepts any number of times
+    '''
+    assert self.obs is not None, 'snapshot() called before reset'
+    return SimpleNamespace(
+      realm=self.realm.snapshot(),
+      dead_agents=OrderedSet(self._dead_agents),
+      scripted_agents=OrderedSet(self.scripted_agents),
+      np_random=np.random.get_state(),
+      random=random.getstate()
+    )
+
+  def restore(self, snapshot):
+    '''Returns the simulation to the state captured by snapshot()
+
+    Returns:
+        observations, as documented by _compute_observations()
+    '''
+    self.realm.restore(snapshot.realm)
+    self._dead_agents = OrderedSet(snapshot.dead_agents)
+    self.scripted_agents = OrderedSet(snapshot.scripted_agents)
+    np.random.set_state(snapshot.np_random)
+    random.setstate(snapshot.random)
+
+    self.obs = self._compute_observations()
+    return self._gym_observations()
+
+  def save_checkpoint(self, path: str):
+    '''Writes the simulation state to the directory path, to resume a
+    persistent world in another process with load_checkpoint()
+
+    The loading Env must use the same config. Logs and replays are not saved.
+    '''
+    write_checkpoint(path, self.realm, self.snapshot())
+
+  def load_checkpoint(self, path: str):
+    '''Resumes the simulation from a directory written by save_checkpoint()
+
+    Returns:
+        observations, as documented by _compute_observations()
+    '''
+    if self.obs is None:
+      self.reset()
+    return self.restore(read_checkpoint(path, self.realm))
+
   def _validate_actions(self, actions: Dict[int, Dict[str, Dict[str, Any]]]):
     '''Deserialize action arg values and validate actions
        For now, it does a basic validation (e.g., value is not none).
@@ -342,31 +398,83 @@ class Env(ParallelEnv):
         '''
 
     obs = {}
+    self._obs_generation += 1
+
+    market = self.realm.exchange.for_sale()
 
-    market = Item.Query.for_sale(self.realm.datastore)
+    agents = list(self.realm.players.values())
+    agent_ids = [agent.id.val for agent in agents]
+    if self.config.PROVIDE_LAZY_OBS and self.config.PROVIDE_LAZY_OBS_QUERIES:
+      return self._lazy(agent_ids, functools.partial(self._query_observation, market))
 
-    for agent in self.realm.players.values():
-      agent_id = agent.id.val
-      agent_r = agent.row.val
-      agent_c = agent.col.val
+    # Query the visible entities, tiles and inventory of all agents at once
+    agent_r = [agent.row.val for agent in agents]
+    agent_c = [agent.col.val for agent in agents]
 
-      visible_entities = Entity.Query.window(
-          self.realm.datastore,
-          agent_r, agent_c,
-          self.config.PLAYER_VISION_RADIUS
-      )
-      visible_tiles = Tile.Query.window(
-          self.realm.datastore,
-          agent_r, agent_c,
-          self.config.PLAYER_VISION_RADIUS)
+    visible_entities = Entity.Query.window_batch(
+        self.realm.datastore,
+        agent_r, agent_c,
+        self.config.PLAYER_VISION_RADIUS
+    )
+    visible_tiles = Tile.Query.window_batch(
+        self.realm.datastore,
+        agent_r, agent_c,
+        self.config.PLAYER_VISION_RADIUS)
 
-      inventory = Item.Query.owned_by(self.realm.datastore, agent_id)
+    inventories = Item.Query.owned_by_batch(self.realm.datastore, agent_ids)
 
+    for idx, agent_id in enumerate(agent_ids):
       obs[agent_id] = Observation(
-        self.config, agent_id, visible_tiles, visible_entities, inventory, market)
+        self.config, agent_id, visible_tiles[idx], visible_entities[idx],
+        inventories[idx], market)
+
+    # Lazy gym observations batch the masks on first access instead
+    if self.config.PROVIDE_ACTION_TARGETS and not self.config.PROVIDE_LAZY_OBS:
+      self._attach_action_targets(list(obs.values()))
 
     return obs
 
+  def _attach_action_targets(self, observations: List[Observation]):
+    targets = make_action_targets_batch(self.config, observations)
+    for agent_obs, agent_targets in zip(observations, targets):
+      agent_obs.action_targets = agent_targets
+
+  def _query_observation(self, market, agent_id):
+    '''Observation of one agent, from queries around that agent alone'''
+    agent = self.realm.players[agent_id]
+    row, col = agent.row.val, agent.col.val
+    radius = self.config.PLAYER_VISION_RADIUS
+    return Observation(
+      self.config, agent_id,
+      Tile.Query.window(self.realm.datastore, row, col, radius),
+      Entity.Query.window(self.realm.datastore, row, col, radius),
+      Item.Query.owned_by(self.realm.datastore, agent_id), market)
+
+  def _gym_observations(self):
+    '''Gym observations of all agents, converted on access with PROVIDE_LAZY_OBS'''
+    obs = self.obs
+    if not self.config.PROVIDE_LAZY_OBS:
+      return {a: o.to_gym(self._obs_buffers) for a,o in obs.items()}
+
+    # The masks of the agents a learner reads, i.e. those not scripted, are
+    # built in one batch. Scripted agents build their own if read
+    learners = [agent_id for agent_id in obs if agent_id not in self.scripted_agents]
+    def build(agent_id):
+      if self.config.PROVIDE_ACTION_TARGETS and agent_id not in self.scripted_agents and \
+          obs[agent_id].action_targets is None:
+        self._attach_action_targets([obs[learner] for learner in learners])
+      return obs[agent_id].to_gym(self._obs_buffers)
+    return self._lazy(obs.keys(), build)
+
+  def _lazy(self, agent_ids, build):
+    # Built from the current state, so only valid until the next observations
+    generation = self._obs_generation
+    def build_current(agent_id):
+      assert self._obs_generation == generation, \
+        'Lazy observations are only valid until the next reset, step or restore'
+      return build(agent_id)
+    return LazyObservationDict(agent_ids, build_current)
+
   def _compute_rewards(self, agents: List[AgentID], dones: Dict[AgentID, bool]):
     '''Computes the reward for the specified agent
 
@@ -415,7 +523,8 @@ class Env(ParallelEnv):
     return list(self.realm.players.keys())
 
   def close(self):
-    '''For conformity with the PettingZoo API only; rendering is external'''
+    '''Releases the shared memory of the datastore, if any'''
+    self.realm.datastore.close()
 
   def seed(self, seed=None):
     return self._init_random(seed)
@@ -1,11 +1,12 @@
-import os
 import logging
+import os
 
 import numpy as np
 from ordered_set import OrderedSet
-from nmmo.core.tile import Tile
+from nmmo.core.tile import Tile, TileGrid, TileState
 
 from nmmo.lib import material
+from nmmo.lib.priorityqueue import PriorityQueue
 
 
 class Map:
@@ -17,7 +18,29 @@ class Map:
     self.config = config
     self._repr  = None
     self.realm  = realm
-    self.update_list = None
+    self.map_id = None
+
+    # Depleted tiles in order of depletion, by flat position, with the
+    # respawn probability of their material. Harvests are appended to
+    # _harvested and merged into the arrays once per step. Tiles that
+    # respawned stay listed until the next step, as they always have,
+    # and keep their place if harvested again before then
+    self._depleted = np.zeros(0, dtype=np.int64)
+    self._respawn = np.zeros(0)
+    self._harvested = []
+    self._respawned = set()
+    self._marked = np.zeros(config.MAP_SIZE**2, dtype=bool)
+
+    # With MAP_SCHEDULE_RESPAWNS, the tick each depleted tile respawns is
+    # sampled once, when the step that depleted it merges the harvest.
+    # The queue holds the flat positions due at each tick as one array
+    self._scheduled = config.MAP_SCHEDULE_RESPAWNS
+    self._schedule = PriorityQueue(np.inf)
+    self._unscheduled = []
+
+    if config.MAP_TILE_VIEWS:
+      self.tiles = TileGrid(realm)
+      return
 
     sz          = config.MAP_SIZE
     self.tiles  = np.zeros((sz, sz), dtype=object)
@@ -26,6 +49,80 @@ class Map:
       for c in range(sz):
         self.tiles[r, c] = Tile(realm, r, c)
 
+    # Base materials of the loaded map, or -1 before the first load
+    self._material_index = np.full((sz, sz), -1, dtype=np.int16)
+    self._row_ids = np.array([t.datastore_record.id for t in self.tiles.flat])
+
+  @property
+  def update_list(self):
+    '''Depleted tiles, in the order they were depleted'''
+    self._merge_harvested()
+    size = self.config.MAP_SIZE
+    return OrderedSet(self.tiles[divmod(idx, size)] for idx in self._depleted.tolist())
+
+  @update_list.setter
+  def update_list(self, tiles):
+    size = self.config.MAP_SIZE
+    tiles = list(tiles)
+    self._harvested = []
+    self._depleted = np.array([r*size + c for r, c in (t.pos for t in tiles)], dtype=np.int64)
+    self._respawn = np.array([t.material.respawn for t in tiles], dtype=np.float64)
+    self._respawned = {r*size + c for r, c in (t.pos for t in tiles if not t.depleted)}
+
+    # Respawns are memoryless, so listed tiles can be scheduled afresh
+    self._schedule = PriorityQueue(np.inf)
+    self._unscheduled = [(t.pos[0]*size + t.pos[1], t.material.respawn)
+                         for t in tiles if t.depleted]
+
+  @property
+  def respawn_schedule(self):
+    '''Scheduled respawns as (tick, flat positions), or None if drawn every tick'''
+    if not self._scheduled:
+      return None
+    return list(reversed(self._schedule.tolist()))
+
+  @respawn_schedule.setter
+  def respawn_schedule(self, schedule):
+    if not self._scheduled or schedule is None:
+      return
+    self._schedule = PriorityQueue(np.inf)
+    scheduled = set()
+    for tick, flat in schedule:
+      self._schedule.push(flat, tick)
+      scheduled.update(flat.tolist())
+    self._unscheduled = [(idx, p) for idx, p in self._unscheduled if idx not in scheduled]
+
+  def _merge_harvested(self):
+    if self._harvested:
+      depleted, respawn = zip(*self._harvested)
+      self._depleted = np.concatenate([self._depleted, depleted])
+      self._respawn = np.concatenate([self._respawn, respawn])
+      self._harvested = []
+
+  def _schedule_harvested(self):
+    if not self._unscheduled:
+      return
+    idx, prob = zip(*self._unscheduled)
+    self._unscheduled = []
+
+    # Ticks until the first successful draw of one per tick, starting with
+    # this one, as when drawing every tick. Tiles that never respawn are dropped
+    prob = np.minimum(prob, 1.0)
+    idx = np.array(idx, dtype=np.int64)[prob > 0]
+    due = self.realm.tick + np.random.geometric(prob[prob > 0]) - 1
+
+    order = np.argsort(due, kind='stable')
+    ticks, starts = np.unique(due[order], return_index=True)
+    for tick, flat in zip(ticks.tolist(), np.split(idx[order], starts[1:])):
+      self._schedule.push(flat, tick)
+
+  def _due_respawns(self):
+    self._schedule_harvested()
+    due = [np.zeros(0, dtype=np.int64)]
+    while self._schedule.n and self._schedule.nextPriority <= self.realm.tick:
+      due.append(self._schedule.pop()[1])
+    return np.concatenate(due)
+
   @property
   def packet(self):
     '''Packet of degenerate resource states'''
@@ -42,41 +139,115 @@ class Map:
 
     return self._repr
 
+  @property
+  def materials(self):
+    '''Matrix of the base material index of each tile'''
+    if isinstance(self.tiles, TileGrid):
+      return self.tiles.material.copy()
+    return self._material_index.astype(np.uint8)
+
   def reset(self, map_id):
     '''Reuse the current tile objects to load a new map'''
-    config = self.config
-    self.update_list = OrderedSet()
-
-    path_map_suffix = config.PATH_MAP_SUFFIX.format(map_id)
-    f_path = os.path.join(config.PATH_CWD, config.PATH_MAPS, path_map_suffix)
+    generator = self.realm.map_generator
+    if hasattr(generator, 'map_path'):
+      f_path = generator.map_path(map_id)
+    else:
+      # Custom generators may predate map_path and save to the map{i} layout
+      config = self.config
+      path_map_suffix = config.PATH_MAP_SUFFIX.format(map_id)
+      f_path = os.path.join(config.PATH_CWD, config.PATH_MAPS, path_map_suffix)
 
     try:
-      map_file = np.load(f_path)
+      # Read-only and memory-mapped, so processes share the map in the page cache
+      map_file = np.load(f_path, mmap_mode='r')
     except FileNotFoundError:
       logging.error('Maps not found')
       raise
 
-    materials = {mat.index: mat for mat in material.All}
-    for r, row in enumerate(map_file):
-      for c, idx in enumerate(row):
-        mat  = materials[idx]
-        tile = self.tiles[r, c]
-        tile.reset(mat, config)
+    self.load(map_id, map_file)
 
-  def step(self):
-    '''Evaluate updatable tiles'''
-    self.realm.log_milestone('Resource_Depleted', len(self.update_list),
-        f'RESOURCE: Depleted {len(self.update_list)} resource tiles')
+  def load(self, map_id, map_file):
+    '''Reuse the current tile objects to load a matrix of material indices
+
+    Only tiles whose material changed or that were depleted are reset,
+    so reloading the same map costs little. Material instances are not
+    mutated, so tiles share one per material'''
+    self.map_id = map_id
+    map_file = np.asarray(map_file)
+
+    if isinstance(self.tiles, TileGrid):
+      self.update_list = OrderedSet()
+      self.tiles.reset(map_file)
+      return
+
+    stale = map_file != self._material_index
+    self._merge_harvested()
+    stale.ravel()[self._depleted] = True
+    self.update_list = OrderedSet()
+
+    TileState.State.table(self.realm.datastore).update_column(
+      self._row_ids, TileState.State.attr_name_to_col["material_id"], map_file.ravel())
+    self._material_index[:] = map_file
 
-    for e in self.update_list.copy():
-      if not e.depleted:
-        self.update_list.remove(e)
-      e.step()
+    materials = {mat.index: mat(self.config) for mat in material.All}
+    for r, c in zip(*np.nonzero(stale)):
+      self.tiles[r, c].load(materials[map_file[r, c]])
+
+  def step(self):
+    '''Respawn each depleted tile with the respawn probability of its material
+
+    Either draws for every depleted tile, or with MAP_SCHEDULE_RESPAWNS
+    only visits the tiles scheduled to respawn this tick'''
+    self._merge_harvested()
+    self.realm.log_milestone('Resource_Depleted', len(self._depleted),
+        f'RESOURCE: Depleted {len(self._depleted)} resource tiles')
+
+    if self._respawned:
+      # Marking the map is cheaper than searching the list, which can be long
+      flat = np.fromiter(self._respawned, dtype=np.int64, count=len(self._respawned))
+      self._marked[flat] = True
+      kept = ~self._marked[self._depleted]
+      self._marked[flat] = False
+      self._depleted = self._depleted[kept]
+      self._respawn = self._respawn[kept]
+      self._respawned = set()
+
+    if self._scheduled:
+      flat = self._due_respawns()
+    elif len(self._depleted) > 0:
+      # One draw per tile in order of depletion, the same sequence as a draw per tile
+      flat = self._depleted[np.random.rand(len(self._depleted)) <= self._respawn]
+    else:
+      return
+
+    if len(flat) == 0:
+      return
+
+    self._respawned = set(flat.tolist())
+
+    if isinstance(self.tiles, TileGrid):
+      self.tiles.respawn(flat)
+      return
+
+    TileState.State.table(self.realm.datastore).update_column(
+      self._row_ids[flat], TileState.State.attr_name_to_col["material_id"],
+      self._material_index.ravel()[flat])
+    for idx in flat.tolist():
+      tile = self.tiles.flat[idx]
+      tile.load(tile.material)
 
   def harvest(self, r, c, deplete=True):
     '''Called by actions that harvest a resource tile'''
+    tile = self.tiles[r, c]
+    drop = tile.harvest(deplete)
 
     if deplete:
-      self.update_list.add(self.tiles[r, c])
-
-    return self.tiles[r, c].harvest(deplete)
+      idx = r*self.config.MAP_SIZE + c
+      if idx in self._respawned:
+        self._respawned.remove(idx)
+      else:
+        self._harvested.append((idx, tile.material.respawn))
+      if self._scheduled:
+        self._unscheduled.append((idx, tile.material.respawn))
+
+    return drop
@@ -1,4 +1,5 @@
-from functools import lru_cache
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, List
 
 import numpy as np
 
@@ -10,6 +11,34 @@ from nmmo.io import action
 from nmmo.lib import material, utils
 
 
+# Skill whose level limits the level of usable items of each type,
+# where None stands for the agent's highest level
+ITEM_SKILL = {
+  item_system.Hat: None,
+  item_system.Top: None,
+  item_system.Bottom: None,
+  item_system.Sword: "melee_level",
+  item_system.Bow: "range_level",
+  item_system.Wand: "mage_level",
+  item_system.Rod: "fishing_level",
+  item_system.Gloves: "herbalism_level",
+  item_system.Pickaxe: "prospecting_level",
+  item_system.Chisel: "carving_level",
+  item_system.Arcane: "alchemy_level",
+  item_system.Scrap: "melee_level",
+  item_system.Shaving: "range_level",
+  item_system.Shard: "mage_level",
+  item_system.Ration: None,
+  item_system.Poultice: None
+}
+
+SKILLS = ["melee_level", "range_level", "mage_level",
+          "fishing_level", "herbalism_level", "prospecting_level",
+          "carving_level", "alchemy_level"]
+
+AMMO = [item_system.Scrap, item_system.Shaving, item_system.Shard]
+
+
 class BasicObs:
   def __init__(self, values, id_col):
     self.values = values
@@ -37,6 +66,87 @@ class InventoryObs(BasicObs):
     return idx[0] if len(idx) else None
 
 
+class ObsBuffers:
+  '''Preallocated float32 arrays that to_gym writes observations into
+
+  Each object type has one array of shape (n_agents, N_OBS, n_attrs),
+  indexed by agent id - 1. The rows written last time are remembered,
+  so that only the stale rows past the new observation are zeroed'''
+  def __init__(self, config):
+    shapes = {
+      "Tile": (config.MAP_N_OBS, TileState.State.num_attributes),
+      "Entity": (config.PLAYER_N_OBS, EntityState.State.num_attributes),
+    }
+    if config.ITEM_SYSTEM_ENABLED:
+      shapes["Inventory"] = (config.INVENTORY_N_OBS, ItemState.State.num_attributes)
+    if config.EXCHANGE_SYSTEM_ENABLED:
+      shapes["Market"] = (config.MARKET_N_OBS, ItemState.State.num_attributes)
+
+    self.arrays = {key: np.zeros((config.PLAYER_N, *shape), dtype=np.float32)
+                   for key, shape in shapes.items()}
+    self._rows = {key: np.zeros(config.PLAYER_N, dtype=np.int64) for key in shapes}
+
+  def write(self, key, agent_id, values):
+    '''Writes the rows of one observation and returns a view of its buffer'''
+    out = self.arrays[key][agent_id - 1]
+    rows = self._rows[key]
+    num_rows = len(values)
+    out[:num_rows] = values
+    if rows[agent_id - 1] > num_rows:
+      out[num_rows:rows[agent_id - 1]] = 0
+    rows[agent_id - 1] = num_rows
+    return out
+
+
+class LocalTiles:
+  '''The visible tiles as (2R+1, 2R+1) grids centered on the agent
+
+  The tile at an offset (r_delta, c_delta) from the agent is at
+  [r_delta + radius, c_delta + radius]. Tiles that are not visible
+  have index and material_id -1'''
+  def __init__(self, tiles, row, col, radius):
+    self.radius = radius
+    size = 2*radius + 1
+
+    # Row of each tile in the observed tile array
+    self.index = np.full((size, size), -1, dtype=np.int64)
+    rows = tiles[:, TileState.State.attr_name_to_col["row"]].astype(np.int64) - int(row)
+    cols = tiles[:, TileState.State.attr_name_to_col["col"]].astype(np.int64) - int(col)
+    self.index[rows + radius, cols + radius] = np.arange(len(tiles))
+
+    self.material_id = np.where(
+      self.index >= 0, tiles[self.index, TileState.State.attr_name_to_col["material_id"]], -1)
+    self.habitable = np.isin(self.material_id, list(material.Habitable.indices))
+    self.impassible = np.isin(self.material_id, list(material.Impassible.indices))
+
+
+class LazyObservationDict(Mapping):
+  '''Read-only mapping of agent ids to values that are built on first access
+
+  Holds the keys up front and calls build(agent_id) at most once per key,
+  e.g. to convert or query the observation of only the agents that are read'''
+  def __init__(self, keys: Iterable, build: Callable):
+    self._keys = dict.fromkeys(keys)
+    self._build = build
+    self._values = {}
+
+  def __getitem__(self, agent_id):
+    if agent_id not in self._values:
+      if agent_id not in self._keys:
+        raise KeyError(agent_id)
+      self._values[agent_id] = self._build(agent_id)
+    return self._values[agent_id]
+
+  def __contains__(self, agent_id):
+    return agent_id in self._keys
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  def __len__(self):
+    return len(self._keys)
+
+
 class Observation:
   def __init__(self,
     config,
@@ -49,6 +159,9 @@ class Observation:
     self.config = config
     self.agent_id = agent_id
 
+    # Masks computed for many agents at once, see make_action_targets_batch
+    self.action_targets = None
+
     self.tiles = tiles[0:config.MAP_N_OBS]
     self.entities = BasicObs(entities[0:config.PLAYER_N_OBS],
                               EntityState.State.attr_name_to_col["id"])
@@ -65,8 +178,7 @@ class Observation:
     else:
       assert market.size == 0
 
-  # pylint: disable=method-cache-max-size-none
-  @lru_cache(maxsize=None)
+  @utils.memoize
   def tile(self, r_delta, c_delta):
     '''Return the array object corresponding to a nearby tile
 
@@ -77,26 +189,46 @@ class Observation:
     Returns:
         Vector corresponding to the specified tile
     '''
+    grid = self.local_tiles()
+    r, c = r_delta + grid.radius, c_delta + grid.radius
+    if not (0 <= r < len(grid.index) and 0 <= c < len(grid.index)) or grid.index[r, c] < 0:
+      raise IndexError(f'Tile ({r_delta}, {c_delta}) is not visible')
+    return TileState.parse_array(self.tiles[grid.index[r, c]])
+
+  @utils.memoize
+  def local_tiles(self):
+    '''Visible tiles as grids centered on the agent, for direct lookups'''
     agent = self.agent()
-    r_cond = (self.tiles[:,TileState.State.attr_name_to_col["row"]] == agent.row + r_delta)
-    c_cond = (self.tiles[:,TileState.State.attr_name_to_col["col"]] == agent.col + c_delta)
-    return TileState.parse_array(self.tiles[r_cond & c_cond][0])
+    return LocalTiles(self.tiles, agent.row, agent.col, self.config.PLAYER_VISION_RADIUS)
 
-  # pylint: disable=method-cache-max-size-none
-  @lru_cache(maxsize=None)
+  @utils.memoize
   def entity(self, entity_id):
     rows = self.entities.values[self.entities.ids == entity_id]
     if rows.size == 0:
       return None
     return EntityState.parse_array(rows[0])
 
-  # pylint: disable=method-cache-max-size-none
-  @lru_cache(maxsize=None)
+  @utils.memoize
   def agent(self):
     return self.entity(self.agent_id)
 
-  def to_gym(self):
-    '''Convert the observation to a format that can be used by OpenAI Gym'''
+  def to_gym(self, buffers: ObsBuffers = None):
+    '''Convert the observation to a format that can be used by OpenAI Gym
+
+    With buffers, the arrays are views into them and valid until they are
+    written again, typically on the next step'''
+    if buffers is not None:
+      gym_obs = {
+        "Tile": buffers.write("Tile", self.agent_id, self.tiles),
+        "Entity": buffers.write("Entity", self.agent_id, self.entities.values),
+      }
+      if self.config.ITEM_SYSTEM_ENABLED:
+        gym_obs["Inventory"] = buffers.write("Inventory", self.agent_id, self.inventory.values)
+      if self.config.EXCHANGE_SYSTEM_ENABLED:
+        gym_obs["Market"] = buffers.write("Market", self.agent_id, self.market.values)
+      if self.config.PROVIDE_ACTION_TARGETS:
+        gym_obs["ActionTargets"] = self._action_targets()
+      return gym_obs
 
     gym_obs = {
       "Tile": np.vstack([
@@ -125,10 +257,15 @@ class Observation:
       ])
 
     if self.config.PROVIDE_ACTION_TARGETS:
-      gym_obs["ActionTargets"] = self._make_action_targets()
+      gym_obs["ActionTargets"] = self._action_targets()
 
     return gym_obs
 
+  def _action_targets(self):
+    if self.action_targets is not None:
+      return self.action_targets
+    return self._make_action_targets()
+
   def _make_action_targets(self):
     # TODO(kywch): return all-0 masks for buy/sell/give during combat
 
@@ -176,9 +313,10 @@ class Observation:
     return masks
 
   def _make_move_mask(self):
+    grid = self.local_tiles()
     # pylint: disable=not-an-iterable
     return np.array(
-      [self.tile(*d.delta).material_id in material.Habitable
+      [grid.habitable[d.delta[0] + grid.radius, d.delta[1] + grid.radius]
        for d in action.Direction.edges], dtype=np.int8)
 
   def _make_attack_mask(self):
@@ -240,26 +378,10 @@ class Observation:
     agent = self.agent()
 
     # the minimum agent level is 1
-    level = max(1, agent.melee_level, agent.range_level, agent.mage_level,
-                agent.fishing_level, agent.herbalism_level, agent.prospecting_level,
-                agent.carving_level, agent.alchemy_level)
+    level = max(1, *(getattr(agent, skill) for skill in SKILLS))
     return {
-      item_system.Hat.ITEM_TYPE_ID: level,
-      item_system.Top.ITEM_TYPE_ID: level,
-      item_system.Bottom.ITEM_TYPE_ID: level,
-      item_system.Sword.ITEM_TYPE_ID: agent.melee_level,
-      item_system.Bow.ITEM_TYPE_ID: agent.range_level,
-      item_system.Wand.ITEM_TYPE_ID: agent.mage_level,
-      item_system.Rod.ITEM_TYPE_ID: agent.fishing_level,
-      item_system.Gloves.ITEM_TYPE_ID: agent.herbalism_level,
-      item_system.Pickaxe.ITEM_TYPE_ID: agent.prospecting_level,
-      item_system.Chisel.ITEM_TYPE_ID: agent.carving_level,
-      item_system.Arcane.ITEM_TYPE_ID: agent.alchemy_level,
-      item_system.Scrap.ITEM_TYPE_ID: agent.melee_level,
-      item_system.Shaving.ITEM_TYPE_ID: agent.range_level,
-      item_system.Shard.ITEM_TYPE_ID: agent.mage_level,
-      item_system.Ration.ITEM_TYPE_ID: level,
-      item_system.Poultice.ITEM_TYPE_ID: level
+      item.ITEM_TYPE_ID: level if skill is None else getattr(agent, skill)
+      for item, skill in ITEM_SKILL.items()
     }
 
   def _make_destroy_item_mask(self):
@@ -334,8 +456,7 @@ class Observation:
   def _existing_ammo_listings(self):
     sig_col = (ItemState.State.attr_name_to_col["type_id"],
                ItemState.State.attr_name_to_col["level"])
-    ammo_id = [ammo.ITEM_TYPE_ID for ammo in
-              [item_system.Scrap, item_system.Shaving, item_system.Shard]]
+    ammo_id = [ammo.ITEM_TYPE_ID for ammo in AMMO]
 
     # search ammo stack from the inventory
     type_flt = np.tile( np.array(ammo_id), (self.inventory.len,1))
@@ -360,3 +481,159 @@ class Observation:
     not_mine = self.market.values[:,ItemState.State.attr_name_to_col["owner_id"]] != self.agent_id
 
     return exist_ammo_listings & not_mine
+
+
+def _stack(arrays, num_rows):
+  '''Pads a list of (rows, cols) arrays with zeros into one (n, num_rows, cols) array
+
+  Also returns the (n, num_rows) mask of the rows that are not padding'''
+  out = np.zeros((len(arrays), num_rows, arrays[0].shape[1]), dtype=arrays[0].dtype)
+  lengths = np.zeros(len(arrays), dtype=np.int64)
+  for idx, arr in enumerate(arrays):
+    lengths[idx] = len(arr)
+    out[idx, :len(arr)] = arr
+  return out, np.arange(num_rows) < lengths[:, None]
+
+def make_action_targets_batch(config, observations: List[Observation]) -> List[Dict]:
+  '''Action target masks of many agents at once
+
+  Gives the same masks as Observation._make_action_targets, but each mask
+  is computed for all agents as one (n_agents, N) array. The masks of
+  each agent are views of its rows'''
+  # pylint: disable=too-many-locals,too-many-statements
+  if not observations:
+    return []
+
+  num_agents = len(observations)
+  rows = np.arange(num_agents)
+  ent_col = EntityState.State.attr_name_to_col
+  item_col = ItemState.State.attr_name_to_col
+  tile_col = TileState.State.attr_name_to_col
+  agent_ids = np.array([obs.agent_id for obs in observations])
+
+  entities, ent_valid = _stack([obs.entities.values for obs in observations],
+                               config.PLAYER_N_OBS)
+  ent_ids = entities[:, :, ent_col["id"]]
+  is_self = ent_ids == agent_ids[:, None]
+  agents = entities[rows, is_self.argmax(axis=1)]
+  agent = {attr: agents[:, col] for attr, col in ent_col.items()}
+
+  ent_pos = entities[:, :, [ent_col["row"], ent_col["col"]]]
+  agent_pos = np.stack([agent["row"], agent["col"]], axis=1)
+  distance = np.abs(ent_pos - agent_pos[:, None, :]).max(axis=2)
+  same_population = entities[:, :, ent_col["population_id"]] == agent["population_id"][:, None]
+
+  def ones(num):
+    return np.ones((num_agents, num), dtype=np.int8)
+
+  masks = {}
+
+  # Move: the tile in each direction is habitable
+  tiles, _ = _stack([obs.tiles for obs in observations], config.MAP_N_OBS)
+  habitable = np.zeros(max(material.All.indices) + 1, dtype=bool)
+  habitable[list(material.Habitable.indices)] = True
+  move = np.zeros((num_agents, len(action.Direction.edges)), dtype=np.int8)
+  # pylint: disable=not-an-iterable
+  for idx, direction in enumerate(action.Direction.edges):
+    r_delta, c_delta = direction.delta
+    found = (tiles[:, :, tile_col["row"]] == (agent["row"] + r_delta)[:, None]) & \
+            (tiles[:, :, tile_col["col"]] == (agent["col"] + c_delta)[:, None])
+    # Tiles that are not observed, e.g. past the map edge, are not habitable
+    material_id = tiles[rows, found.argmax(axis=1), tile_col["material_id"]]
+    move[:, idx] = habitable[material_id.astype(np.int64)] & found.any(axis=1)
+  masks[action.Move] = {action.Direction: move}
+
+  if config.COMBAT_SYSTEM_ENABLED:
+    assert config.COMBAT_MELEE_REACH == config.COMBAT_RANGE_REACH
+    assert config.COMBAT_MELEE_REACH == config.COMBAT_MAGE_REACH
+
+    within_range = distance <= config.COMBAT_MELEE_REACH
+    immunity = config.COMBAT_SPAWN_IMMUNITY
+    spawn_immunity = np.where(
+      ((0 < immunity) & (immunity < agent["time_alive"]))[:, None],
+      (ent_ids > 0) & (entities[:, :, ent_col["time_alive"]] < immunity), True)
+    no_friendly_fire = ~is_self if config.COMBAT_FRIENDLY_FIRE else ~same_population
+
+    masks[action.Attack] = {
+      action.Style: ones(len(action.Style.edges)),
+      action.Target: (within_range & no_friendly_fire & spawn_immunity & ent_valid)
+                     .astype(np.int8)
+    }
+
+  # Without items, nothing can be given, sold or bought with a full inventory
+  full = np.zeros(num_agents, dtype=bool)
+  sell = np.zeros((num_agents, config.INVENTORY_N_OBS), dtype=np.int8)
+  give_target = np.zeros((num_agents, config.PLAYER_N_OBS), dtype=np.int8)
+  if config.ITEM_SYSTEM_ENABLED:
+    inventory, inv_valid = _stack([obs.inventory.values for obs in observations],
+                                  config.INVENTORY_N_OBS)
+    has_items = inv_valid.any(axis=1)
+    inv_type = inventory[:, :, item_col["type_id"]].astype(np.int64)
+    not_equipped = inventory[:, :, item_col["equipped"]] == 0
+    not_listed = inventory[:, :, item_col["listed_price"]] == 0
+
+    # Highest usable level of each item type, by agent
+    level = np.maximum.reduce([np.ones(num_agents), *(agent[skill] for skill in SKILLS)])
+    max_level = np.full((num_agents, max(
+      inv_type.max(), *(item.ITEM_TYPE_ID for item in ITEM_SKILL)) + 1), -np.inf)
+    for item, skill in ITEM_SKILL.items():
+      max_level[:, item.ITEM_TYPE_ID] = level if skill is None else agent[skill]
+    level_satisfied = inventory[:, :, item_col["level"]] <= max_level[rows[:, None], inv_type]
+
+    full = inv_valid.sum(axis=1) >= config.ITEM_INVENTORY_CAPACITY
+    if config.EXCHANGE_SYSTEM_ENABLED:
+      sell = (not_equipped & not_listed & inv_valid).astype(np.int8)
+    give_target = ((distance == 0) & ~is_self & same_population & ent_valid &
+                   has_items[:, None]).astype(np.int8)
+
+    masks[action.Use] = {
+      action.InventoryItem: (not_listed & level_satisfied & inv_valid).astype(np.int8)
+    }
+    masks[action.Give] = {
+      action.InventoryItem: sell,
+      action.Target: give_target
+    }
+    masks[action.Destroy] = {
+      action.InventoryItem: (not_equipped & inv_valid).astype(np.int8)
+    }
+
+  if config.EXCHANGE_SYSTEM_ENABLED:
+    market = observations[0].market.values
+    gold = agent["gold"]
+    buy = (market[:, item_col["listed_price"]][None, :] <= gold[:, None]) & \
+          (market[:, item_col["owner_id"]][None, :] != agent_ids[:, None])
+
+    # With a full inventory, only listings that stack onto owned ammo can be bought
+    if full.any():
+      ammo = np.isin(inv_type[full], [item.ITEM_TYPE_ID for item in AMMO]) & inv_valid[full]
+      same_type = market[:, item_col["type_id"]][None, :, None] == inv_type[full][:, None, :]
+      same_level = market[:, item_col["level"]][None, :, None] == \
+                   inventory[full][:, :, item_col["level"]][:, None, :]
+      buy[full] &= (same_type & same_level & ammo[:, None, :]).any(axis=2)
+
+    buy_mask = np.zeros((num_agents, config.MARKET_N_OBS), dtype=np.int8)
+    buy_mask[:, :len(market)] = buy
+    masks[action.Sell] = {
+      action.InventoryItem: sell,
+      action.Price: ones(len(action.Price.edges))
+    }
+    masks[action.Buy] = {
+      action.MarketItem: buy_mask
+    }
+    masks[action.GiveGold] = {
+      action.Target: give_target,
+      # NOTE that action.Price starts from Discrete_1
+      action.Price: (np.arange(config.PRICE_N_OBS) < gold.astype(np.int64)[:, None])
+                    .astype(np.int8)
+    }
+
+  if config.COMMUNICATION_SYSTEM_ENABLED:
+    masks[action.Comm] = {
+      action.Token: ones(len(action.Token.edges))
+    }
+
+  # Hashing the action classes dominates here, so rows are split off up front
+  split = [(atn, [(arg, list(mask)) for arg, mask in args.items()])
+           for atn, args in masks.items()]
+  return [{atn: {arg: mask[idx] for arg, mask in args} for atn, args in split}
+          for idx in range(num_agents)]
@@ -11,11 +11,13 @@ from nmmo.core.log_helper import LogHelper
 from nmmo.core.map import Map
 from nmmo.core.render_helper import RenderHelper
 from nmmo.core.replay_helper import ReplayHelper
+from nmmo.core.snapshot import RealmSnapshot
 from nmmo.core.tile import TileState
 from nmmo.entity.entity import EntityState
 from nmmo.entity.entity_manager import NPCManager, PlayerManager
 from nmmo.io.action import Action, Buy
 from nmmo.datastore.numpy_datastore import NumpyDatastore
+from nmmo.datastore.shared_datastore import SharedNumpyDatastore
 from nmmo.systems.exchange import Exchange
 from nmmo.systems.item import Item, ItemState
 
@@ -39,11 +41,42 @@ class Realm:
     Action.hook(config)
 
     # Generate maps if they do not exist
-    config.MAP_GENERATOR(config).generate_all_maps()
-
-    self.datastore = NumpyDatastore()
-    for s in [TileState, EntityState, ItemState]:
-      self.datastore.register_object_type(s._name, s.State.num_attributes)
+    self.map_generator = config.MAP_GENERATOR(config)
+    self.map_generator.generate_all_maps()
+
+    if config.DATASTORE_SHARED_MEMORY:
+      self.datastore = SharedNumpyDatastore()
+    else:
+      self.datastore = NumpyDatastore()
+    dtype = {s: s.storage_dtype() if config.DATASTORE_COMPACT_DTYPES else np.float32
+             for s in [EntityState, ItemState, TileState]}
+    for s in [EntityState, ItemState]:
+      self.datastore.register_object_type(s._name, s.State.num_attributes,
+        dtype=dtype[s], compact=config.DATASTORE_COMPACT_ROWS)
+
+    tile_grid = None
+    if config.DATASTORE_TILE_GRID:
+      tile_grid = (config.MAP_SIZE,
+        TileState.State.attr_name_to_col["row"], TileState.State.attr_name_to_col["col"])
+    self.datastore.register_object_type(
+      TileState._name, TileState.State.num_attributes, grid=tile_grid, dtype=dtype[TileState])
+
+    if config.DATASTORE_SPATIAL_INDEX:
+      # Cells one vision radius wide keep each window within 3x3 cells
+      # Grid tile tables need no index, since their windows are slices
+      indexed = [EntityState] if config.DATASTORE_TILE_GRID else [TileState, EntityState]
+      for s in indexed:
+        s.State.table(self.datastore).index_spatial(
+          s.State.attr_name_to_col["row"], s.State.attr_name_to_col["col"],
+          config.PLAYER_VISION_RADIUS + 1)
+
+    if config.DATASTORE_ITEM_OWNER_INDEX:
+      ItemState.State.table(self.datastore).index_hash(
+        ItemState.State.attr_name_to_col["owner_id"])
+
+    if config.DATASTORE_DIRTY_TRACKING:
+      for s in [EntityState, ItemState, TileState]:
+        s.State.table(self.datastore).track_dirty()
 
     self.tick = 0
     self.exchange = None
@@ -99,6 +132,14 @@ class Realm:
 
     self.replay_helper.update()
 
+  def snapshot(self) -> RealmSnapshot:
+    """Capture the world state, which restore() reinstates"""
+    return RealmSnapshot.capture(self)
+
+  def restore(self, snapshot: RealmSnapshot):
+    """Reinstate a world state captured by snapshot()"""
+    snapshot.restore(self)
+
   def packet(self):
     """Client packet"""
     return {
@@ -140,6 +181,9 @@ class Realm:
     Returns:
         dead: List of dead agents
     """
+    # Changes are recorded per step
+    self.datastore.clear_dirty()
+
     # Prioritize actions
     npc_actions = self.npcs.actions(self)
     merged = defaultdict(list)
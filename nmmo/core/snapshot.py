@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import types
+from collections import deque
+from typing import Any, Dict
+
+import numpy as np
+from ordered_set import OrderedSet
+
+from nmmo.datastore.datastore import DatastoreRecord
+from nmmo.datastore.serialized import SerializedAttribute
+from nmmo.systems.item import Item
+
+"""
+In-memory snapshots of a Realm, used to branch and roll back a
+simulation without replaying it from reset.
+
+The datastore tables are copied as arrays. The Python-side game objects
+(entities, items, exchange listings) are kept by the snapshot, which
+captures their mutable contents once as flat lists: the fields of each
+object, the elements of each container and the cached value of each
+attribute. Restoring writes these contents back into the same objects,
+so restores copy contents but never rebuild the object graph. The realm,
+config, datastore and map are shared and not captured. Tiles are
+persistent, so only the depleted tiles and tile occupancy are recorded
+and rebuilt. Logging, replay and render helpers are not part of the
+world state and are left untouched by restore.
+"""
+
+def shared_objects(realm) -> Dict[str, Any]:
+  '''Objects that game objects reference but do not own, by name'''
+  return {
+    'realm': realm,
+    'config': realm.config,
+    'datastore': realm.datastore,
+    'map': realm.map,
+    'log_helper': realm.log_helper,
+    'replay_helper': realm.replay_helper,
+    'render_helper': realm.render_helper,
+    **{f'table_{name}': realm.datastore.table(name)
+       for name in ['Entity', 'Item', 'Tile']}
+  }
+
+# Values whose contents never change, so they are neither captured nor walked
+_IMMUTABLE = (int, float, complex, str, bytes, bool, type(None), np.generic, range,
+              type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+              types.MethodType, DatastoreRecord)
+
+class ObjectState:
+  '''Contents of every mutable object reachable from roots, excluding the
+  shared objects, which restore() writes back in place any number of times'''
+  def __init__(self, roots, shared):
+    self.roots = roots
+    self.values = []  # (SerializedAttribute, cached value)
+    self.fields = []  # (object, copy of its __dict__)
+    self.lists = []   # (list or deque, tuple of elements)
+    self.dicts = []   # (dict, tuple of items)
+    self.sets = []    # (set, tuple of elements)
+    self.arrays = []  # (ndarray, copy)
+    self._capture(roots, shared)
+
+  def _capture(self, roots, shared):
+    seen = {id(obj) for obj in shared}
+    stack = [roots]
+    while stack:
+      obj = stack.pop()
+      if isinstance(obj, _IMMUTABLE) or id(obj) in seen:
+        continue
+      seen.add(id(obj))
+
+      if isinstance(obj, SerializedAttribute):
+        # Only the cached value changes, the rest is fixed when created
+        self.values.append((obj, obj.val))
+      elif isinstance(obj, (list, deque)):
+        self.lists.append((obj, tuple(obj)))
+        stack.extend(obj)
+      elif isinstance(obj, dict):
+        self.dicts.append((obj, tuple(obj.items())))
+        stack.extend(obj.keys())
+        stack.extend(obj.values())
+      elif isinstance(obj, set):
+        self.sets.append((obj, tuple(obj)))
+        stack.extend(obj)
+      elif isinstance(obj, (tuple, frozenset)):
+        stack.extend(obj)
+      elif isinstance(obj, np.ndarray):
+        if obj.flags.writeable:
+          self.arrays.append((obj, obj.copy()))
+        if obj.dtype.hasobject:
+          stack.extend(obj.ravel().tolist())
+      else:
+        fields = dict(vars(obj))
+        self.fields.append((obj, fields))
+        stack.extend(fields.values())
+
+  def restore(self):
+    '''Write the captured contents back and return the roots'''
+    for attr, value in self.values:
+      attr.set_cached(value)
+    for obj, fields in self.fields:
+      obj.__dict__.clear()
+      obj.__dict__.update(fields)
+    for seq, elements in self.lists:
+      seq.clear()
+      seq.extend(elements)
+    for dct, items in self.dicts:
+      dct.clear()
+      dct.update(items)
+    for elements_set, elements in self.sets:
+      elements_set.clear()
+      elements_set.update(elements)
+    for arr, data in self.arrays:
+      arr[...] = data
+    return self.roots
+
+class RealmSnapshot:
+  '''World state of a Realm, which can be restored any number of times'''
+  # pylint: disable=too-many-positional-arguments
+  def __init__(self, map_id, tick, item_instance_id, tables, objects, tiles,
+               map_materials=None, respawns=None):
+    self.map_id = map_id
+    self.map_materials = map_materials
+    self.tick = tick
+    self.item_instance_id = item_instance_id
+    self.tables = tables
+    self.objects = objects
+    self.tiles = tiles
+    self.respawns = respawns
+
+  @classmethod
+  def capture(cls, realm) -> RealmSnapshot:
+    return cls(
+      map_id=realm.map.map_id,
+      tick=realm.tick,
+      item_instance_id=Item.INSTANCE_ID,
+      tables=realm.datastore.snapshot(),
+      objects=ObjectState(
+        (realm.players, realm.npcs, realm.exchange, realm.items),
+        shared_objects(realm).values()),
+      tiles=[(*tile.pos, tile.depleted, tile.state) for tile in realm.map.update_list],
+      respawns=realm.map.respawn_schedule)
+
+  def restore(self, realm):
+    # Loading a map rewrites the tile table, so it precedes the tables
+    if self.map_materials is not None:
+      realm.map.load(self.map_id, self.map_materials)
+    elif realm.map.map_id != self.map_id:
+      realm.map.reset(self.map_id)
+
+    realm.datastore.restore(self.tables)
+    realm.tick = self.tick
+    Item.INSTANCE_ID = self.item_instance_id
+
+    # Occupants are looked up by their current positions before restoring
+    _remove_occupants(realm)
+    realm.players, realm.npcs, realm.exchange, realm.items = self.objects.restore()
+    _add_occupants(realm)
+
+    for tile in realm.map.update_list:
+      tile.depleted = False
+      tile.state = tile.material
+      tile.material_id.update(tile.state.index)
+
+    for r, c, depleted, state in self.tiles:
+      tile = realm.map.tiles[r, c]
+      tile.depleted = depleted
+      tile.state = state
+      tile.material_id.update(state.index)
+    # Tiles that respawned last tick are listed but no longer depleted
+    realm.map.update_list = OrderedSet(realm.map.tiles[r, c] for r, c, _, _ in self.tiles)
+    realm.map.respawn_schedule = self.respawns
+
+def _remove_occupants(realm):
+  for group in [realm.players, realm.npcs]:
+    for entity in group.entities.values():
+      realm.map.tiles[entity.pos].entities = {}
+
+def _add_occupants(realm):
+  for group in [realm.players, realm.npcs]:
+    for entity in group.entities.values():
+      realm.map.tiles[entity.pos].add_entity(entity)
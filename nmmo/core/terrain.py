@@ -1,7 +1,13 @@
 
+from contextlib import contextmanager
+import hashlib
+import json
+import multiprocessing as mp
 import os
 import random
 import logging
+import shutil
+import tempfile
 
 import numpy as np
 import vec_noise
@@ -11,6 +17,11 @@ from tqdm import tqdm
 
 from nmmo import material
 
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
 
 def sharp(noise):
   '''Exponential noise sharpener for perlin ridges'''
@@ -33,14 +44,20 @@ class Save:
 
   @staticmethod
   def as_numpy(mats, path):
-    '''Save map to .npy'''
+    '''Save map to .npy as one uint8 material index per tile
+
+    The file is a plain array after the .npy header, so it can be
+    memory-mapped and shared through the page cache by many processes'''
+    mats = np.asarray(mats)
+    assert mats.min() >= 0 and mats.max() <= np.iinfo(np.uint8).max, \
+      'Material indices do not fit in uint8'
     path = os.path.join(path, 'map.npy')
-    np.save(path, mats.astype(int))
+    np.save(path, mats.astype(np.uint8))
 
 # pylint: disable=E1101:no-member
 # Terrain uses setattr()
 class Terrain:
-  '''Terrain material class; populated at runtime'''
+  '''Terrain material class; populated with the material indices below'''
   @staticmethod
   def generate_terrain(config, map_id, interpolaters):
     center      = config.MAP_CENTER
@@ -50,11 +67,7 @@ class Terrain:
     offset      = config.TERRAIN_FREQUENCY_OFFSET
     octaves     = center // config.TERRAIN_TILES_PER_OCTAVE
 
-    #Compute a unique seed based on map index
-    #Flip seed used to ensure train/eval maps are different
-    seed = map_id + 1
-    if config.TERRAIN_FLIP_SEED:
-      seed = -seed
+    seed = map_seed(config, map_id)
 
     #Log interpolation factor
     if not interpolaters:
@@ -101,16 +114,20 @@ class Terrain:
     noise = noise.astype(int)
 
     #Compute L1 and Perlin scale factor
-    for i in range(octaves):
-      start             = octaves - i - 1
-      scale[l1 <= high] = np.arange(start, start + octaves)
-      high             -= delta
+    #Cells within the i-th of the shrinking L1 radii scale octave j by
+    #octaves - i - 1 + j, where i is the innermost radius that covers them
+    highs = []
+    for _ in range(octaves):
+      highs.append(high)
+      high -= delta
+    covers = np.searchsorted(-np.array(highs), -l1, side='right')
 
     start   = noise - 1
     l1_scale = np.clip(l1, 0, size//2 - border - 2)
     l1_scale = l1_scale / np.max(l1_scale)
     for i in range(octaves):
-      idxs           = l1_scale*scale[:, :, i] + (1-l1_scale)*(start + i)
+      l1_octave      = np.where(covers > 0, octaves - covers + i, 0)
+      idxs           = l1_scale*l1_octave + (1-l1_scale)*(start + i)
       scale[:, :, i] = pdf[idxs.astype(int)]
 
     #Blend octaves
@@ -122,19 +139,10 @@ class Terrain:
     val = 0.5 + np.clip(val, -1, 1)/2
 
     #Threshold to materials
-    matl = np.zeros((size, size), dtype=object)
-    for y in range(size):
-      for x in range(size):
-        v = val[y, x]
-        if v <= config.TERRAIN_WATER:
-          mat = Terrain.WATER
-        elif v <= config.TERRAIN_GRASS:
-          mat = Terrain.GRASS
-        elif v <= config.TERRAIN_FOREST:
-          mat = Terrain.FOREST
-        else:
-          mat = Terrain.STONE
-        matl[y, x] = mat
+    matl = np.select(
+      [val <= config.TERRAIN_WATER, val <= config.TERRAIN_GRASS, val <= config.TERRAIN_FOREST],
+      [Terrain.WATER, Terrain.GRASS, Terrain.FOREST],
+      default=Terrain.STONE)
 
     #Lava and grass border
     matl[l1 > size/2 - border]   = Terrain.LAVA
@@ -146,64 +154,147 @@ class Terrain:
 
     return val, matl, interpolaters
 
-def fish(config, tiles, mat, mmin, mmax):
-  r = random.randint(mmin, mmax)
-  c = random.randint(mmin, mmax)
-
-  allow = {Terrain.GRASS}
-  if (tiles[r, c] not in {Terrain.WATER} or
-          (tiles[r-1, c] not in allow and tiles[r+1, c] not in allow and
-          tiles[r, c-1] not in allow and tiles[r, c+1] not in allow)):
-    fish(config, tiles, mat, mmin, mmax)
-  else:
-    tiles[r, c] = mat
-
-def uniform(config, tiles, mat, mmin, mmax):
-  r = random.randint(mmin, mmax)
-  c = random.randint(mmin, mmax)
-
-  if tiles[r, c] not in {Terrain.GRASS}:
-    uniform(config, tiles, mat, mmin, mmax)
-  else:
-    tiles[r, c] = mat
-
-def cluster(config, tiles, mat, mmin, mmax):
-  mmin = mmin + 1
-  mmax = mmax - 1
-
-  r = random.randint(mmin, mmax)
-  c = random.randint(mmin, mmax)
-
-  matls = {Terrain.GRASS}
-  if tiles[r, c] not in matls:
-    cluster(config, tiles, mat, mmin-1, mmax+1)
+# Set on import rather than by MapGenerator, so that worker processes
+# that unpickle a generator without running __init__ also have them
+for _mat in material.All:
+  setattr(Terrain, _mat.tex.upper(), _mat.index)
+
+def map_seed(config, map_id):
+  '''Unique seed based on map index
+
+  Flip seed used to ensure train/eval maps are different'''
+  seed = map_id + 1
+  if config.TERRAIN_FLIP_SEED:
+    seed = -seed
+  return seed
+
+class Candidates:
+  '''Positions where a resource may be placed, sampled uniformly
+
+  Placing resources only ever removes valid positions, so candidates are
+  computed once. Picks that are no longer valid are dropped and redrawn,
+  which keeps the pick uniform over the currently valid positions'''
+  def __init__(self, mask, valid):
+    self.flat = np.flatnonzero(mask)
+    self.count = len(self.flat)
+    self.size = mask.shape[1]
+    self.valid = valid
+
+  def sample(self, tiles, rng):
+    '''A valid position, or None if there is none left'''
+    while self.count:
+      idx = rng.randrange(self.count)
+      pos = divmod(int(self.flat[idx]), self.size)
+      if self.valid(tiles, pos):
+        return pos
+
+      self.count -= 1
+      self.flat[idx] = self.flat[self.count]
+    return None
+
+def _square(tiles, mmin, mmax):
+  mask = np.zeros(tiles.shape, dtype=bool)
+  mask[mmin:mmax+1, mmin:mmax+1] = True
+  return mask
+
+def _grass(tiles, pos):
+  return tiles[pos] == Terrain.GRASS
+
+def _fishable(tiles, pos):
+  r, c = pos
+  return tiles[r, c] == Terrain.WATER and Terrain.GRASS in (
+    tiles[r-1, c], tiles[r+1, c], tiles[r, c-1], tiles[r, c+1])
+
+def grass_candidates(tiles, mmin, mmax):
+  return Candidates(_square(tiles, mmin, mmax) & (tiles == Terrain.GRASS), _grass)
+
+def fish_candidates(tiles, mmin, mmax):
+  grass = tiles == Terrain.GRASS
+  near_grass = np.zeros(tiles.shape, dtype=bool)
+  near_grass[1:] |= grass[:-1]
+  near_grass[:-1] |= grass[1:]
+  near_grass[:, 1:] |= grass[:, :-1]
+  near_grass[:, :-1] |= grass[:, 1:]
+  mask = _square(tiles, mmin, mmax) & (tiles == Terrain.WATER) & near_grass
+  return Candidates(mask, _fishable)
+
+def place(tiles, mat, candidates, rng):
+  '''Place mat on a single candidate tile'''
+  pos = candidates.sample(tiles, rng)
+  if pos is None:
+    logging.warning('No valid tile left to place material %s', mat)
     return
+  tiles[pos] = mat
 
+def cluster(tiles, mat, candidates, rng):
+  '''Place mat on a candidate tile and its adjacent grass tiles'''
+  pos = candidates.sample(tiles, rng)
+  if pos is None:
+    logging.warning('No valid tile left to place material %s', mat)
+    return
+
+  r, c = pos
   tiles[r, c] = mat
-  if tiles[r-1, c] in matls:
-    tiles[r-1, c] = mat
-  if tiles[r+1, c] in matls:
-    tiles[r+1, c] = mat
-  if tiles[r, c-1] in matls:
-    tiles[r, c-1] = mat
-  if tiles[r, c+1] in matls:
-    tiles[r, c+1] = mat
-
-def spawn_profession_resources(config, tiles):
+  for adj in [(r-1, c), (r+1, c), (r, c-1), (r, c+1)]:
+    if tiles[adj] == Terrain.GRASS:
+      tiles[adj] = mat
+
+def spawn_profession_resources(config, tiles, map_id):
+  # Seeded per map, so that a map only depends on its config and index
+  rng  = random.Random(map_seed(config, map_id))
   mmin = config.MAP_BORDER + 1
   mmax = config.MAP_SIZE - config.MAP_BORDER - 1
 
+  # Clusters are centered one tile further in, so they stay within the square
+  clusters = grass_candidates(tiles, mmin + 1, mmax - 1)
   for _ in range(config.PROGRESSION_SPAWN_CLUSTERS):
-    cluster(config, tiles, Terrain.ORE, mmin, mmax)
-    cluster(config, tiles, Terrain.TREE, mmin, mmax)
-    cluster(config, tiles, Terrain.CRYSTAL, mmin, mmax)
+    cluster(tiles, Terrain.ORE, clusters, rng)
+    cluster(tiles, Terrain.TREE, clusters, rng)
+    cluster(tiles, Terrain.CRYSTAL, clusters, rng)
 
+  herbs = grass_candidates(tiles, mmin, mmax)
+  fish = fish_candidates(tiles, mmin, mmax)
   for _ in range(config.PROGRESSION_SPAWN_UNIFORMS):
-    uniform(config, tiles, Terrain.HERB, mmin, mmax)
-    fish(config, tiles, Terrain.FISH, mmin, mmax)
+    place(tiles, Terrain.HERB, herbs, rng)
+    place(tiles, Terrain.FISH, fish, rng)
+
+def _call(job):
+  func, args = job
+  return func(*args)
+
+@contextmanager
+def _file_lock(path):
+  '''Exclusive lock across processes. Without fcntl, writers rely on
+  the atomic rename alone and may generate the same map twice
+
+  The lock file is removed before the lock is released. Writers already
+  waiting on it still wait for the release, and then find the map in place'''
+  with open(path, 'a', encoding='utf-8') as lock:
+    if fcntl is not None:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
 
 class MapGenerator:
   '''Procedural map generation'''
+
+  VERSION = 1
+  '''Bump when generation changes, to invalidate cached maps'''
+
+  FINGERPRINT_FIELDS = [
+    'MAP_CENTER', 'MAP_BORDER', 'PROFESSION_SYSTEM_ENABLED',
+    'PROGRESSION_SPAWN_CLUSTERS', 'PROGRESSION_SPAWN_UNIFORMS']
+  '''Config fields that maps depend on, besides the TERRAIN_ fields
+
+  MAP_N is not one of them, since each map depends only on its own index'''
+
   def __init__(self, config):
     self.config = config
     self.load_textures()
@@ -218,7 +309,6 @@ class MapGenerator:
       key = mat.tex
       tex = imread(path.format(key))
       lookup[mat.index] = tex[:, :, :3][::scale, ::scale]
-      setattr(Terrain, key.upper(), mat.index)
     self.textures = lookup
 
   def generate_all_maps(self):
@@ -231,25 +321,100 @@ class MapGenerator:
     #Only generate if maps are not cached
     path_maps = os.path.join(config.PATH_CWD, config.PATH_MAPS)
     os.makedirs(path_maps, exist_ok=True)
+    if config.MAP_CACHE:
+      os.makedirs(os.path.join(path_maps, 'cache'), exist_ok=True)
+      self._run_all(self.generate_cached_map, [(idx,) for idx in range(config.MAP_N)])
+      return
+
     if not config.MAP_FORCE_GENERATION and os.listdir(path_maps):
       return
 
     if __debug__:
       logging.info('Generating %s maps', str(config.MAP_N))
 
-    for idx in tqdm(range(config.MAP_N)):
+    jobs = []
+    for idx in range(config.MAP_N):
       path = path_maps + '/map' + str(idx+1)
       os.makedirs(path, exist_ok=True)
+      jobs.append((idx, path))
+    self._run_all(self.save_map, jobs)
+
+  def _run_all(self, func, jobs):
+    '''Call func for each tuple of args in jobs, in parallel across
+    MAP_GENERATION_WORKERS processes when there is more than one
+
+    Maps are seeded by index, so the result does not depend on the order'''
+    workers = min(self.config.MAP_GENERATION_WORKERS, len(jobs))
+    if workers <= 1:
+      for args in tqdm(jobs):
+        func(*args)
+      return
 
-      terrain, tiles = self.generate_map(idx)
+    context = mp.get_context(self.config.MAP_GENERATION_START_METHOD)
+    with context.Pool(workers) as pool:
+      for _ in tqdm(pool.imap_unordered(_call, [(func, args) for args in jobs]),
+                    total=len(jobs)):
+        pass
 
-      #Save/render
-      Save.as_numpy(tiles, path)
-      if config.MAP_GENERATE_PREVIEWS:
-        b = config.MAP_BORDER
-        tiles = [e[b:-b+1] for e in tiles][b:-b+1]
-        Save.fractal(terrain, path+'/fractal.png')
-        Save.render(tiles, self.textures, path+'/map.png')
+  def save_map(self, idx, path):
+    '''Generate map idx and save it, with optional previews, to the directory path'''
+    config = self.config
+    terrain, tiles = self.generate_map(idx)
+
+    #Save/render
+    Save.as_numpy(tiles, path)
+    if config.MAP_GENERATE_PREVIEWS:
+      b = config.MAP_BORDER
+      tiles = [e[b:-b+1] for e in tiles][b:-b+1]
+      Save.fractal(terrain, path+'/fractal.png')
+      Save.render(tiles, self.textures, path+'/map.png')
+
+  def fingerprint(self, idx):
+    '''Hash of everything that map idx depends on: the generator, its
+    version, the map index and the terrain and profession config'''
+    config = self.config
+    fields = {key: repr(getattr(config, key)) for key in dir(config)
+              if key.startswith('TERRAIN_') or key in self.FINGERPRINT_FIELDS}
+    key = json.dumps({
+      'generator': f'{type(self).__module__}.{type(self).__qualname__}',
+      'version': self.VERSION,
+      'map': idx,
+      'config': fields,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+  def map_path(self, map_id):
+    '''Path of the .npy file of map_id, counting from 1'''
+    config = self.config
+    path_maps = os.path.join(config.PATH_CWD, config.PATH_MAPS)
+    if config.MAP_CACHE:
+      return os.path.join(path_maps, 'cache', self.fingerprint(map_id - 1), 'map.npy')
+    return os.path.join(path_maps, config.PATH_MAP_SUFFIX.format(map_id))
+
+  def generate_cached_map(self, idx):
+    '''Generate map idx into the cache, unless another process already has
+
+    Each map is generated under a lock into a temporary directory, which
+    is then renamed into place, so readers never see a partial map'''
+    path = os.path.dirname(self.map_path(idx + 1))
+    if os.path.exists(path):
+      return
+
+    with _file_lock(path + '.lock'):
+      if os.path.exists(path):
+        return
+
+      tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.tmp_')
+      try:
+        self.save_map(idx, tmp)
+        os.rename(tmp, path)
+      except OSError:
+        # Renaming fails when losing the race to a writer that did not hold the lock
+        if not os.path.exists(path):
+          raise
+      finally:
+        # Left behind only if generation failed or the race was lost
+        shutil.rmtree(tmp, ignore_errors=True)
 
   def generate_map(self, idx):
     '''Generate a single map
@@ -272,17 +437,11 @@ class MapGenerator:
     else:
       size    = config.MAP_SIZE
       terrain = np.zeros((size, size))
-      tiles   = np.zeros((size, size), dtype=object)
-
-      for r in range(size):
-        for c in range(size):
-          linf = max(abs(r - size//2), abs(c - size//2))
-          if linf <= size//2 - config.MAP_BORDER:
-            tiles[r, c] = Terrain.GRASS
-          else:
-            tiles[r, c] = Terrain.LAVA
+      dist    = np.abs(np.arange(size) - size//2)
+      linf    = np.maximum(dist[:, None], dist[None, :])
+      tiles   = np.where(linf <= size//2 - config.MAP_BORDER, Terrain.GRASS, Terrain.LAVA)
 
     if config.PROFESSION_SYSTEM_ENABLED:
-      spawn_profession_resources(config, tiles)
+      spawn_profession_resources(config, tiles, idx)
 
     return terrain, tiles
@@ -1,4 +1,8 @@
+from __future__ import annotations
+
+from collections import namedtuple
 from types import SimpleNamespace
+from typing import Dict, Tuple
 import numpy as np
 
 from nmmo.datastore.serialized import SerializedState
@@ -18,11 +22,21 @@ TileState.Limits = lambda config: {
   "material_id": (0, config.MAP_N_TILE),
 }
 
+TileState.Dtypes = {
+  "row": np.int16,
+  "col": np.int16,
+  "material_id": np.uint8,
+}
+
 TileState.Query = SimpleNamespace(
   window=lambda ds, r, c, radius: ds.table("Tile").window(
     TileState.State.attr_name_to_col["row"],
     TileState.State.attr_name_to_col["col"],
     r, c, radius),
+  window_batch=lambda ds, rs, cs, radius: ds.table("Tile").window_batch(
+    TileState.State.attr_name_to_col["row"],
+    TileState.State.attr_name_to_col["col"],
+    rs, cs, radius),
 )
 
 class Tile(TileState):
@@ -71,6 +85,16 @@ class Tile(TileState):
 
     self.entities = {}
 
+  def load(self, mat):
+    '''Reset to a shared material instance whose index was already
+    written to the material_id column, as Map.load does in bulk'''
+    self.state = mat
+    self.material = mat
+    self.material_id.set_cached(mat.index)
+
+    self.depleted = False
+    self.tex = mat.tex
+
   def add_entity(self, ent):
     assert ent.ent_id not in self.entities
     self.entities[ent.ent_id] = ent
@@ -79,13 +103,202 @@ class Tile(TileState):
     assert ent_id in self.entities
     del self.entities[ent_id]
 
-  def step(self):
-    if not self.depleted or np.random.rand() > self.material.respawn:
-      return
+  def harvest(self, deplete):
+    assert not self.depleted, f'{self.state} is depleted'
+    assert self.state in material.Harvestable, f'{self.state} not harvestable'
+
+    if deplete:
+      self.depleted = True
+      self.state = self.material.deplete(self.config)
+      self.material_id.update(self.state.index)
+
+    return self.material.harvest()
+
+
+# Read-only stand-in for the row and col attributes of a TileView
+_Position = namedtuple('_Position', ['val'])
+
+class TileGrid:
+  '''Tile state of a whole map held in numpy grids, for MAP_TILE_VIEWS
+
+  Stands in for the MAP_SIZE x MAP_SIZE array of Tile objects. Indexing
+  returns a TileView created on demand, so that only the tiles in use
+  exist as Python objects. Occupancy is kept sparsely for occupied tiles'''
+  def __init__(self, realm):
+    self.realm = realm
+    self.config = realm.config
+    size = self.config.MAP_SIZE
+    self.shape = (size, size)
+
+    # Material indices of the base material and the current state
+    self.material = np.zeros(self.shape, dtype=np.uint8)
+    self.state = np.zeros(self.shape, dtype=np.uint8)
+    self.depleted = np.zeros(self.shape, dtype=bool)
+    self.entities: Dict[Tuple[int, int], Dict] = {}
+
+    # Material instances are not mutated, so all tiles share one per material
+    self.materials = {mat.index: mat(self.config) for mat in material.All}
+
+    # Rows are added in row-major order, like Tile objects, i.e. r*size + c + 1
+    self.table = TileState.State.table(realm.datastore)
+    self.row_ids = np.array([self.table.add_row() for _ in range(size*size)])
+    rows, cols = np.divmod(self.row_ids - 1, size)
+    self._column("row", rows)
+    self._column("col", cols)
+
+  def __getitem__(self, pos) -> TileView:
+    r, c = pos
+    r, c = int(r), int(c)
+    # Negative indices wrap around, as they do for the array of Tile objects
+    size = self.shape[0]
+    r, c = r + size if r < 0 else r, c + size if c < 0 else c
+    if not (0 <= r < size and 0 <= c < size):
+      raise IndexError(f'Tile ({r}, {c}) is out of bounds')
+    return TileView(self, r, c)
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __iter__(self):
+    size = self.shape[0]
+    for r in range(size):
+      yield [TileView(self, r, c) for c in range(size)]
+
+  def reset(self, map_file):
+    '''Load a matrix of material indices and clear depletion
+
+    Occupants are removed by their entity groups, as with Tile objects'''
+    self.material[:] = map_file
+    self.state[:] = self.material
+    self.depleted[:] = False
+    self._column("material_id", self.state.ravel())
+
+  def respawn(self, flat):
+    '''Restore the base material of the depleted tiles at the flat positions'''
+    self.depleted.ravel()[flat] = False
+    self.state.ravel()[flat] = self.material.ravel()[flat]
+    self.table.update_column(self.row_ids[flat],
+      TileState.State.attr_name_to_col["material_id"], self.material.ravel()[flat])
+
+  def set_state(self, r, c, index):
+    self.state[r, c] = index
+    self.table.update(self.row_ids[r*self.shape[0] + c],
+      TileState.State.attr_name_to_col["material_id"], index)
+
+  def _column(self, name, values):
+    self.table.update_column(self.row_ids, TileState.State.attr_name_to_col[name], values)
+
+class TileView:
+  '''Tile interface over the grids of a TileGrid at one position
+
+  Views of the same position compare and hash equal, so they can stand
+  in for Tile objects in sets such as Map.update_list'''
+  __slots__ = ['grid', 'r', 'c']
+
+  def __init__(self, grid: TileGrid, r: int, c: int):
+    self.grid = grid
+    self.r = r
+    self.c = c
+
+  def __eq__(self, other):
+    return isinstance(other, TileView) and other.grid is self.grid \
+      and other.r == self.r and other.c == self.c
+
+  def __hash__(self):
+    return hash((self.r, self.c))
+
+  @property
+  def realm(self):
+    return self.grid.realm
+
+  @property
+  def config(self):
+    return self.grid.config
+
+  @property
+  def row(self):
+    return _Position(self.r)
+
+  @property
+  def col(self):
+    return _Position(self.c)
 
+  @property
+  def material_id(self):
+    return _MaterialId(self)
+
+  @property
+  def repr(self):
+    return self.pos
+
+  @property
+  def pos(self):
+    return self.r, self.c
+
+  @property
+  def material(self):
+    return self.grid.materials[self.grid.material[self.r, self.c]]
+
+  @property
+  def state(self):
+    return self.grid.materials[self.grid.state[self.r, self.c]]
+
+  @state.setter
+  def state(self, mat):
+    self.grid.set_state(self.r, self.c, mat.index)
+
+  @property
+  def depleted(self):
+    return bool(self.grid.depleted[self.r, self.c])
+
+  @depleted.setter
+  def depleted(self, depleted):
+    self.grid.depleted[self.r, self.c] = depleted
+
+  @property
+  def tex(self):
+    return self.material.tex
+
+  @property
+  def entities(self):
+    return self.grid.entities.get(self.pos, {})
+
+  @entities.setter
+  def entities(self, entities):
+    if entities:
+      self.grid.entities[self.pos] = entities
+    else:
+      self.grid.entities.pop(self.pos, None)
+
+  @property
+  def habitable(self):
+    return self.material in material.Habitable
+
+  @property
+  def impassible(self):
+    return self.material in material.Impassible
+
+  @property
+  def lava(self):
+    return self.material == material.Lava
+
+  def reset(self, mat, config):
+    self.grid.material[self.r, self.c] = mat.index
+    self.state = mat(config)
     self.depleted = False
-    self.state = self.material
-    self.material_id.update(self.state.index)
+    self.entities = {}
+
+  def add_entity(self, ent):
+    entities = self.grid.entities.setdefault(self.pos, {})
+    assert ent.ent_id not in entities
+    entities[ent.ent_id] = ent
+
+  def remove_entity(self, ent_id):
+    entities = self.grid.entities.get(self.pos, {})
+    assert ent_id in entities
+    del entities[ent_id]
+    if not entities:
+      del self.grid.entities[self.pos]
 
   def harvest(self, deplete):
     assert not self.depleted, f'{self.state} is depleted'
@@ -94,6 +307,19 @@ class Tile(TileState):
     if deplete:
       self.depleted = True
       self.state = self.material.deplete(self.config)
-      self.material_id.update(self.state.index)
 
     return self.material.harvest()
+
+class _MaterialId:
+  '''The material_id attribute of a TileView, which tracks its state'''
+  __slots__ = ['view']
+
+  def __init__(self, view: TileView):
+    self.view = view
+
+  @property
+  def val(self):
+    return int(self.view.grid.state[self.view.r, self.view.c])
+
+  def update(self, value):
+    self.view.grid.set_state(self.view.r, self.view.c, value)
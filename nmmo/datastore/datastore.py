@@ -25,14 +25,21 @@ See numpy_datastore.py for an implementation.
 class DataTable:
   def __init__(self, num_columns: int):
     self._num_columns = num_columns
-    self._id_allocator = IdAllocator(100)
+    self._id_allocator = self._create_id_allocator()
 
   def reset(self):
-    self._id_allocator = IdAllocator(100)
+    self._id_allocator = self._create_id_allocator()
+
+  def _create_id_allocator(self) -> IdAllocator:
+    # Starts with no free ids; tables expand it along with their capacity
+    return IdAllocator(1)
 
   def update(self, row_id: int, col: int, value):
     raise NotImplementedError
 
+  def update_column(self, row_ids: List[int], col: int, values):
+    raise NotImplementedError
+
   def get(self, ids: List[id]):
     raise NotImplementedError
 
@@ -48,6 +55,12 @@ class DataTable:
   def window(self, row_idx: int, col_idx: int, row: int, col: int, radius: int):
     raise NotImplementedError
 
+  def window_batch(self, row_idx: int, col_idx: int, rows: List, cols: List, radius: int):
+    raise NotImplementedError
+
+  def where_eq_batch(self, col: int, values: List):
+    raise NotImplementedError
+
   def remove_row(self, row_id: int):
     raise NotImplementedError
 
@@ -57,6 +70,15 @@ class DataTable:
   def is_empty(self) -> bool:
     raise NotImplementedError
 
+  def snapshot(self):
+    raise NotImplementedError
+
+  def restore(self, snapshot):
+    raise NotImplementedError
+
+  def clear_dirty(self):
+    '''Forget recorded changes. Tables that do not track changes need not override this'''
+
 class DatastoreRecord:
   def __init__(self, datastore, table: DataTable, row_id: int) -> None:
     self.datastore = datastore
@@ -76,9 +98,9 @@ class Datastore:
   def __init__(self) -> None:
     self._tables: Dict[str, DataTable] = {}
 
-  def register_object_type(self, object_type: str, num_colums: int):
+  def register_object_type(self, object_type: str, num_colums: int, **table_kwargs):
     if object_type not in self._tables:
-      self._tables[object_type] = self._create_table(num_colums)
+      self._tables[object_type] = self._create_table(num_colums, **table_kwargs)
 
   def create_record(self, object_type: str) -> DatastoreRecord:
     table = self._tables[object_type]
@@ -88,5 +110,20 @@ class Datastore:
   def table(self, object_type: str) -> DataTable:
     return self._tables[object_type]
 
-  def _create_table(self, num_columns: int) -> DataTable:
+  def clear_dirty(self):
+    for table in self._tables.values():
+      table.clear_dirty()
+
+  def snapshot(self) -> Dict:
+    '''Copy of every table, to be passed to restore()'''
+    return {name: table.snapshot() for name, table in self._tables.items()}
+
+  def restore(self, snapshot: Dict):
+    for name, table_snapshot in snapshot.items():
+      self._tables[name].restore(table_snapshot)
+
+  def close(self):
+    '''Release resources held outside the process, if any'''
+
+  def _create_table(self, num_columns: int, **table_kwargs) -> DataTable:
     raise NotImplementedError
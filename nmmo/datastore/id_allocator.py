@@ -1,21 +1,77 @@
-from ordered_set import OrderedSet
+from collections import deque
+import heapq
 
 class IdAllocator:
+  '''Hands out free row ids in first-in first-out order
+
+  All operations are O(1): a set answers membership and a deque
+  keeps the order in which ids were freed'''
   def __init__(self, max_id):
     # Key 0 is reserved as padding
     self.max_id = 1
-    self.free  = OrderedSet()
+    self.free  = set()
+    self._queue = self._create_queue()
     self.expand(max_id)
 
   def full(self):
     return len(self.free) == 0
 
   def remove(self, row_id):
+    if row_id in self.free:
+      return
     self.free.add(row_id)
+    self._push(row_id)
 
   def allocate(self):
-    return self.free.pop(0)
+    if self.full():
+      raise KeyError('No free ids')
+    row_id = self._pop()
+    self.free.remove(row_id)
+    return row_id
 
   def expand(self, max_id):
-    self.free.update(OrderedSet(range(self.max_id, max_id)))
-    self.max_id = max_id
+    # New ids are queued last. For the heap below this is also valid,
+    # since they exceed every id already queued
+    ids = range(self.max_id, max_id)
+    self.free.update(ids)
+    self._queue.extend(ids)
+    self.max_id = max(self.max_id, max_id)
+
+  def _create_queue(self):
+    return deque()
+
+  def _push(self, row_id):
+    self._queue.append(row_id)
+
+  def _pop(self):
+    return self._queue.popleft()
+
+class CompactIdAllocator(IdAllocator):
+  '''Hands out the lowest free row id first, in O(log n)
+
+  Live ids then stay packed at the front of the id range, so that
+  tables only need to scan the ids below live_end'''
+  def __init__(self, max_id):
+    self.live_end = 1
+    super().__init__(max_id)
+
+  def remove(self, row_id):
+    super().remove(row_id)
+
+    # Amortized O(1): live_end grows by at most one per allocation
+    while self.live_end > 1 and self.live_end - 1 in self.free:
+      self.live_end -= 1
+
+  def allocate(self):
+    row_id = super().allocate()
+    self.live_end = max(self.live_end, row_id + 1)
+    return row_id
+
+  def _create_queue(self):
+    return []
+
+  def _push(self, row_id):
+    heapq.heappush(self._queue, row_id)
+
+  def _pop(self):
+    return heapq.heappop(self._queue)
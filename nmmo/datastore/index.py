@@ -0,0 +1,125 @@
+import itertools
+from collections import defaultdict
+from typing import Dict, Set, Tuple
+
+import numpy as np
+
+"""
+Secondary indices maintained by a DataTable alongside its rows.
+
+The SpatialIndex buckets rows into square grid cells keyed on their
+(row, col) position. A window query then only visits the cells that
+overlap the window instead of every row in the table.
+
+The HashIndex maps each value of a single column to the rows holding
+it, so that equality queries such as "items owned by agent i" cost
+O(matching rows) instead of a scan.
+
+Indices store row ids, not data. The table remains the source of
+truth and is expected to notify the index whenever an indexed
+column is written or a row is removed.
+"""
+
+class SpatialIndex:
+  def __init__(self, row_idx: int, col_idx: int, cell_size: int):
+    assert cell_size > 0, 'cell_size must be positive'
+    self.row_idx = row_idx
+    self.col_idx = col_idx
+    self.cell_size = cell_size
+
+    self._cells: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+    self._row_cell: Dict[int, Tuple[int, int]] = {}
+    self._by_cell = None
+
+  def reset(self):
+    self._cells = defaultdict(set)
+    self._row_cell = {}
+    self._by_cell = None
+
+  def covers(self, row_idx: int, col_idx: int) -> bool:
+    return row_idx == self.row_idx and col_idx == self.col_idx
+
+  def update(self, row_id: int, row, col):
+    cell = (int(row) // self.cell_size, int(col) // self.cell_size)
+    prev = self._row_cell.get(row_id)
+    if prev == cell:
+      return
+
+    if prev is not None:
+      self._cells[prev].discard(row_id)
+
+    self._cells[cell].add(row_id)
+    self._row_cell[row_id] = cell
+    self._by_cell = None
+
+  def remove(self, row_id: int):
+    cell = self._row_cell.pop(row_id, None)
+    if cell is not None:
+      self._cells[cell].discard(row_id)
+      self._by_cell = None
+
+  def candidates(self, row: int, col: int, radius: int) -> np.ndarray:
+    '''Row ids of every row in a cell overlapping the window
+
+    Candidates are a superset of the window and are returned sorted,
+    so that filtering them yields rows in the same order as a full scan'''
+    size = self.cell_size
+    row_ids = []
+    for cell_r in range(int(row - radius) // size, int(row + radius) // size + 1):
+      for cell_c in range(int(col - radius) // size, int(col + radius) // size + 1):
+        row_ids.extend(self._cells.get((cell_r, cell_c), ()))
+
+    return np.sort(np.array(row_ids, dtype=np.int64))
+
+  def by_cell(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''(cell rows, cell cols, row ids) of every indexed row, ordered by cell
+
+    Rows of a cell are contiguous and cells are in row-major order, so the
+    rows of a run of cells along one cell row are a contiguous slice.
+    Rebuilt lazily after rows change cells'''
+    if self._by_cell is None:
+      cells = sorted(cell for cell, row_ids in self._cells.items() if row_ids)
+      counts = [len(self._cells[cell]) for cell in cells]
+      self._by_cell = (
+        np.repeat(np.array([cell[0] for cell in cells], dtype=np.int64), counts),
+        np.repeat(np.array([cell[1] for cell in cells], dtype=np.int64), counts),
+        np.fromiter(itertools.chain.from_iterable(self._cells[cell] for cell in cells),
+                    dtype=np.int64, count=sum(counts)))
+    return self._by_cell
+
+class HashIndex:
+  def __init__(self, col: int):
+    self.col = col
+
+    self._rows: Dict[float, Set[int]] = {}
+    self._row_value: Dict[int, float] = {}
+
+  def reset(self):
+    self._rows = {}
+    self._row_value = {}
+
+  def update(self, row_id: int, value):
+    prev = self._row_value.get(row_id)
+    if prev == value:
+      return
+
+    if prev is not None:
+      self._discard(prev, row_id)
+
+    self._rows.setdefault(value, set()).add(row_id)
+    self._row_value[row_id] = value
+
+  def remove(self, row_id: int):
+    value = self._row_value.pop(row_id, None)
+    if value is not None:
+      self._discard(value, row_id)
+
+  def lookup(self, value) -> np.ndarray:
+    '''Sorted row ids of the rows holding value'''
+    return np.sort(np.fromiter(self._rows.get(value, ()), dtype=np.int64))
+
+  def _discard(self, value, row_id: int):
+    rows = self._rows[value]
+    rows.discard(row_id)
+    if not rows:
+      del self._rows[value]
@@ -1,46 +1,236 @@
-from typing import List
+import copy
+from typing import Dict, List
 
 import numpy as np
 
 from nmmo.datastore.datastore import Datastore, DataTable
+from nmmo.datastore.id_allocator import CompactIdAllocator
+from nmmo.datastore.index import HashIndex, SpatialIndex
 
 
-class NumpyTable(DataTable):
-  def __init__(self, num_columns: int, initial_size: int, dtype=np.float32):
+class NumpyTable(DataTable): # pylint: disable=too-many-public-methods
+  def __init__(self, num_columns: int, initial_size: int, dtype=np.float32,
+               compact: bool = False):
+    self._compact = compact
     super().__init__(num_columns)
     self._dtype  = dtype
     self._initial_size = initial_size
     self._max_rows = 0
     self._data = np.zeros((0, self._num_columns), dtype=self._dtype)
+    self._spatial_index = None
+    self._hash_indices: Dict[int, HashIndex] = {}
+    self._dirty = None
     self._expand(self._initial_size)
 
   def reset(self):
     super().reset() # resetting _id_allocator
     self._max_rows = 0
     self._data = np.zeros((0, self._num_columns), dtype=self._dtype)
+    if self._dirty is not None:
+      self._dirty = np.zeros((0, self._num_columns), dtype=bool)
+    if self._spatial_index is not None:
+      self._spatial_index.reset()
+    for index in self._hash_indices.values():
+      index.reset()
     self._expand(self._initial_size)
 
+  def _create_id_allocator(self):
+    if self._compact:
+      return CompactIdAllocator(1)
+    return super()._create_id_allocator()
+
+  @property
+  def _rows(self):
+    # Compact tables allocate the lowest free id first, so the rows
+    # past live_end are free and zeroed and need not be scanned
+    if self._compact:
+      return self._data[:self._id_allocator.live_end]
+    return self._data
+
+  def index_spatial(self, row_idx: int, col_idx: int, cell_size: int):
+    '''Maintain a grid bucket index on the (row_idx, col_idx) position columns
+
+    Window queries over these columns then only scan rows in nearby cells.
+    Rows enter the index on their first write to either position column'''
+    self._spatial_index = SpatialIndex(row_idx, col_idx, cell_size)
+    for row_id in np.nonzero(np.any(self._data[:, [row_idx, col_idx]], axis=1))[0]:
+      self._update_spatial_index(row_id)
+
+  def index_hash(self, col: int):
+    '''Maintain a value -> row ids index on col to speed up where_eq queries'''
+    index = HashIndex(col)
+    for row_id in np.nonzero(self._data[:, col])[0]:
+      index.update(row_id, self._data[row_id, col].item())
+    self._hash_indices[col] = index
+
+  def track_dirty(self):
+    '''Record which cells are written or removed until the next clear_dirty()'''
+    self._dirty = np.zeros((self._max_rows, self._num_columns), dtype=bool)
+
+  def clear_dirty(self):
+    if self._dirty is not None:
+      self._dirty[:] = False
+
+  def dirty_rows(self) -> np.ndarray:
+    '''Sorted ids of the rows changed since the last clear_dirty()'''
+    assert self._dirty is not None, 'track_dirty() was not called'
+    return np.nonzero(self._dirty.any(axis=1))[0]
+
+  def dirty_mask(self, ids: List[int]) -> np.ndarray:
+    '''Per-column changed flags of the given rows, aligned with get(ids)'''
+    assert self._dirty is not None, 'track_dirty() was not called'
+    return self._dirty[ids]
+
   def update(self, row_id: int, col: int, value):
     self._data[row_id, col] = value
+    if self._dirty is not None:
+      self._dirty[row_id, col] = True
+    if self._spatial_index is not None and \
+        col in (self._spatial_index.row_idx, self._spatial_index.col_idx):
+      self._update_spatial_index(row_id)
+    if col in self._hash_indices:
+      self._hash_indices[col].update(row_id, self._data[row_id, col].item())
+
+  def update_column(self, row_ids: List[int], col: int, values):
+    '''Write values to col of many rows at once, e.g. when loading a map'''
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    self._data[row_ids, col] = values
+    if self._dirty is not None:
+      self._dirty[row_ids, col] = True
+    if self._spatial_index is not None and \
+        col in (self._spatial_index.row_idx, self._spatial_index.col_idx):
+      for row_id in row_ids.tolist():
+        self._update_spatial_index(row_id)
+    if col in self._hash_indices:
+      for row_id in row_ids.tolist():
+        self._hash_indices[col].update(row_id, self._data[row_id, col].item())
+
+  def _update_spatial_index(self, row_id: int):
+    index = self._spatial_index
+    index.update(row_id, self._data[row_id, index.row_idx], self._data[row_id, index.col_idx])
 
   def get(self, ids: List[int]):
     return self._data[ids]
 
   def where_eq(self, col: int, value):
-    return self._data[self._data[:,col] == value]
+    # Free rows are zeroed but not indexed, so 0 always requires a scan
+    index = self._hash_indices.get(col)
+    if index is not None and value != 0:
+      return self._data[index.lookup(value)]
+
+    data = self._rows
+    return data[data[:,col] == value]
 
   def where_neq(self, col: int, value):
-    return self._data[self._data[:,col] != value]
+    data = self._rows
+    return data[data[:,col] != value]
 
   def where_in(self, col: int, values: List):
-    return self._data[np.isin(self._data[:,col], values)]
+    data = self._rows
+    return data[np.isin(data[:,col], values)]
 
   def window(self, row_idx: int, col_idx: int, row: int, col: int, radius: int):
-    return self._data[(
-      (np.abs(self._data[:,row_idx] - row) <= radius) &
-      (np.abs(self._data[:,col_idx] - col) <= radius)
+    data = self._rows
+    if self._spatial_index is not None and self._spatial_index.covers(row_idx, col_idx):
+      data = data[self._spatial_index.candidates(row, col, radius)]
+
+    return data[(
+      (np.abs(data[:,row_idx] - row) <= radius) &
+      (np.abs(data[:,col_idx] - col) <= radius)
     ).ravel()]
 
+  def window_batch(self, row_idx: int, col_idx: int, rows, cols, radius: int):
+    '''window() evaluated around many centers in one vectorized pass
+
+    Rows are sorted once by position. The window around each center is then
+    a union of 2*radius+1 contiguous runs of that order, one per map row,
+    which are gathered for all centers at once and returned per center.
+    With a spatial index on these columns, the runs are taken over the
+    index's cell order instead, so only rows in nearby cells are visited'''
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if len(rows) == 0:
+      return []
+
+    if self._spatial_index is not None and self._spatial_index.covers(row_idx, col_idx):
+      return self._indexed_window_batch(row_idx, col_idx, rows, cols, radius)
+
+    # Offset cols by radius so that windows never wrap into adjacent rows
+    data = self._rows
+    pos_r = data[:, row_idx].astype(np.int64)
+    pos_c = data[:, col_idx].astype(np.int64) + radius
+    width = max(pos_c.max(), cols.max() + radius) + radius + 1
+    keys = pos_r * width + pos_c
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+
+    run_r = rows[:, None] + np.arange(-radius, radius + 1)
+    lo = np.searchsorted(keys, run_r * width + cols[:, None], side='left')
+    hi = np.searchsorted(keys, run_r * width + cols[:, None] + 2*radius, side='right')
+
+    return self._gather_runs(order, lo.ravel(), hi.ravel(), len(rows))
+
+  def _indexed_window_batch(self, row_idx: int, col_idx: int, rows, cols, radius: int):
+    # Each center's window overlaps one run of cells per cell row. Runs
+    # are padded to the same count per center, with unused runs left empty.
+    # Offset cells by 1 so that windows at the map edge never wrap
+    size = self._spatial_index.cell_size
+    cell_r, cell_c, order = self._spatial_index.by_cell()
+    min_r, max_r = (rows - radius) // size, (rows + radius) // size
+    min_c, max_c = (cols - radius) // size, (cols + radius) // size
+    width = max(cell_c.max(initial=0), max_c.max()) + 3
+    keys = (cell_r + 1) * width + cell_c + 1
+
+    run_r = min_r[:, None] + np.arange((2*radius) // size + 2)
+    lo = np.searchsorted(keys, (run_r + 1) * width + min_c[:, None] + 1, side='left')
+    hi = np.searchsorted(keys, (run_r + 1) * width + max_c[:, None] + 1, side='right')
+    hi = np.where(run_r <= max_r[:, None], hi, lo)
+
+    row_ids, groups = self._run_row_ids(order, lo.ravel(), hi.ravel(), len(rows))
+    inside = (np.abs(self._data[row_ids, row_idx].astype(np.int64) - rows[groups]) <= radius) & \
+             (np.abs(self._data[row_ids, col_idx].astype(np.int64) - cols[groups]) <= radius)
+    return self._split_groups(row_ids[inside], groups[inside], len(rows))
+
+  def where_eq_batch(self, col: int, values):
+    '''where_eq() evaluated for many values in one vectorized pass'''
+    values = np.asarray(values)
+    if len(values) == 0:
+      return []
+
+    index = self._hash_indices.get(col)
+    if index is not None and np.all(values != 0):
+      row_ids = [index.lookup(value) for value in values.tolist()]
+      counts = [len(ids) for ids in row_ids]
+      return np.split(self._data[np.concatenate(row_ids)], np.cumsum(counts)[:-1])
+
+    data = self._rows
+    order = np.argsort(data[:, col], kind='stable')
+    keys = data[order, col]
+    lo = np.searchsorted(keys, values, side='left')
+    hi = np.searchsorted(keys, values, side='right')
+
+    return self._gather_runs(order, lo, hi, len(values))
+
+  def _gather_runs(self, order, lo, hi, num_groups: int):
+    return self._split_groups(*self._run_row_ids(order, lo, hi, num_groups), num_groups)
+
+  @staticmethod
+  def _run_row_ids(order, lo, hi, num_groups: int):
+    # Concatenate order[lo[i]:hi[i]] for all runs without a Python loop,
+    # labelled by group. Each group holds the same number of runs
+    lengths = hi - lo
+    starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+    row_ids = order[starts + np.arange(lengths.sum())]
+
+    counts = lengths.reshape(num_groups, -1).sum(axis=1)
+    return row_ids, np.repeat(np.arange(num_groups), counts)
+
+  def _split_groups(self, row_ids, groups, num_groups: int):
+    # Return the rows of each group in row id order, like a full scan
+    row_ids = row_ids[np.lexsort((row_ids, groups))]
+    counts = np.bincount(groups, minlength=num_groups)
+    return np.split(self._data[row_ids], np.cumsum(counts)[:-1])
+
   def add_row(self) -> int:
     if self._id_allocator.full():
       self._expand(self._max_rows * 2)
@@ -50,21 +240,96 @@ class NumpyTable(DataTable):
   def remove_row(self, row_id: int) -> int:
     self._id_allocator.remove(row_id)
     self._data[row_id] = 0
+    if self._dirty is not None:
+      self._dirty[row_id] = True
+    if self._spatial_index is not None:
+      self._spatial_index.remove(row_id)
+    for index in self._hash_indices.values():
+      index.remove(row_id)
 
   def _expand(self, max_rows: int):
     assert max_rows > self._max_rows
-    data = np.zeros((max_rows, self._num_columns), dtype=self._dtype)
+    data = self._allocate_data(max_rows)
     data[:self._max_rows] = self._data
     self._max_rows = max_rows
     self._id_allocator.expand(max_rows)
     self._data = data
 
+    if self._dirty is not None:
+      dirty = np.zeros((max_rows, self._num_columns), dtype=bool)
+      dirty[:len(self._dirty)] = self._dirty
+      self._dirty = dirty
+
+  def snapshot(self):
+    return copy.deepcopy((
+      self._data, self._max_rows, self._id_allocator,
+      self._spatial_index, self._hash_indices, self._dirty))
+
+  def restore(self, snapshot):
+    max_rows, id_allocator, spatial_index, hash_indices, dirty = \
+      copy.deepcopy(snapshot[1:])
+    if max_rows != self._max_rows:
+      self._data = self._allocate_data(max_rows)
+    self._data[:] = snapshot[0]
+    self._max_rows = max_rows
+    self._id_allocator = id_allocator
+    self._spatial_index = spatial_index
+    self._hash_indices = hash_indices
+    self._dirty = dirty
+
+  def _allocate_data(self, max_rows: int) -> np.ndarray:
+    # Zeroed storage for _expand; overridden to place tables elsewhere
+    return np.zeros((max_rows, self._num_columns), dtype=self._dtype)
+
   def is_empty(self) -> bool:
     all_data_zero = np.sum(self._data)==0
     # 0th row is reserved as padding, so # of free ids is _max_rows-1
     all_id_free = len(self._id_allocator.free) == self._max_rows-1
     return all_data_zero and all_id_free
 
+class NumpyGridTable(NumpyTable):
+  '''NumpyTable holding one row per cell of a dense square grid, e.g. map tiles
+
+  The row at position (r, c) must have row id r*size + c + 1, which holds
+  when rows are added in row-major order. The data is then also viewable
+  as a (size, size, num_columns) grid, so that a window over the position
+  columns is a strided slice instead of a scan over every row'''
+  def __init__(self, num_columns: int, size: int, row_idx: int, col_idx: int, *,
+               dtype=np.float32):
+    self._size = size
+    self._row_idx = row_idx
+    self._col_idx = col_idx
+    super().__init__(num_columns, size*size + 1, dtype)
+
+  @property
+  def grid(self):
+    # Row 0 is reserved as padding, the remainder is a row-major grid view
+    return self._data[1:].reshape(self._size, self._size, self._num_columns)
+
+  def window(self, row_idx: int, col_idx: int, row: int, col: int, radius: int):
+    if (row_idx, col_idx) != (self._row_idx, self._col_idx):
+      return super().window(row_idx, col_idx, row, col, radius)
+    return self._window(int(row), int(col), radius)
+
+  def window_batch(self, row_idx: int, col_idx: int, rows, cols, radius: int):
+    if (row_idx, col_idx) != (self._row_idx, self._col_idx):
+      return super().window_batch(row_idx, col_idx, rows, cols, radius)
+    return [self._window(int(r), int(c), radius) for r, c in zip(rows, cols)]
+
+  def _window(self, row: int, col: int, radius: int):
+    # Row-major like a scan in row id order; reshape makes one contiguous copy
+    return self.grid[
+      max(0, row - radius):row + radius + 1,
+      max(0, col - radius):col + radius + 1].reshape(-1, self._num_columns)
+
+  def add_row(self) -> int:
+    assert not self._id_allocator.full(), 'Grid table is full'
+    return super().add_row()
+
 class NumpyDatastore(Datastore):
-  def _create_table(self, num_columns: int) -> DataTable:
-    return NumpyTable(num_columns, 100)
+  def _create_table(self, num_columns: int, grid=None, dtype=np.float32,
+                    compact: bool = False) -> DataTable:
+    if grid is not None:
+      size, row_idx, col_idx = grid
+      return NumpyGridTable(num_columns, size, row_idx, col_idx, dtype=dtype)
+    return NumpyTable(num_columns, 100, dtype, compact)
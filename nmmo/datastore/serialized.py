@@ -4,6 +4,9 @@ from ast import Tuple
 import math
 from types import SimpleNamespace
 from typing import Dict, List
+
+import numpy as np
+
 from nmmo.datastore.datastore import Datastore, DatastoreRecord
 
 """
@@ -19,6 +22,8 @@ serialized representations of specific types of data, using a
 list of attribute names to define the structure of the data.
 The subclass method is a factory method for creating subclasses
 of SerializedState that are tailored to specific types of data.
+Subclasses may declare a Dtypes schema mapping each attribute to
+the numpy dtype that holds it without loss.
 """
 
 class SerializedAttribute():
@@ -43,6 +48,10 @@ class SerializedAttribute():
     self.datastore_record.update(self._column, value)
     self._val = value
 
+  def set_cached(self, value):
+    '''Set the value after its column was written in bulk, e.g. by DataTable.update_column'''
+    self._val = value
+
   @property
   def min(self):
     return self._min
@@ -82,6 +91,8 @@ class SerializedAttribute():
     return self.val >= other
 
 class SerializedState():
+  Dtypes: Dict[str, np.dtype] = None
+
   @staticmethod
   def subclass(name: str, attributes: List[str]):
     class Subclass(SerializedState):
@@ -117,4 +128,15 @@ class SerializedState():
           attr: data[col] for attr, col in cls.State.attr_name_to_col.items()
         })
 
+      @classmethod
+      def storage_dtype(cls) -> np.dtype:
+        # Tables hold a single 2D array, so the schema's column dtypes
+        # are promoted to the narrowest dtype that can store all of them.
+        # Without a schema, columns are stored as float32.
+        if cls.Dtypes is None:
+          return np.dtype(np.float32)
+        assert set(cls.Dtypes) == set(cls.State.attr_name_to_col), \
+          f"Dtypes of {cls._name} must cover exactly its attributes"
+        return np.result_type(*cls.Dtypes.values())
+
     return Subclass
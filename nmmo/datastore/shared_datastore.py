@@ -0,0 +1,231 @@
+from multiprocessing.shared_memory import SharedMemory
+import os
+from typing import Dict, List
+import uuid
+
+import numpy as np
+
+from nmmo.datastore.numpy_datastore import NumpyDatastore, NumpyGridTable, NumpyTable
+
+"""
+A NumpyDatastore whose tables live in named shared memory blocks, so
+that other processes can map them read-only and query them directly
+instead of receiving pickled observations.
+
+Each table owns two blocks. The header block has a fixed name,
+"<datastore name>_<object type>", and holds HEADER_FIELDS as int64.
+The data block holds the rows and is named after the header block
+and its generation. Growing a table moves its rows to a new data block
+and bumps the generation, which tells readers to map the new block.
+
+The writer does not synchronize with readers, so they should read
+between ticks, e.g. once observations are built.
+"""
+
+HEADER_FIELDS = ['capacity', 'num_columns', 'live_count', 'generation', 'dtype']
+HEADER = {field: idx for idx, field in enumerate(HEADER_FIELDS)}
+
+def _data_block_name(name: str, generation: int) -> str:
+  return f'{name}_{generation}'
+
+class SharedTableMixin:
+  '''Places a NumpyTable's rows in shared memory and publishes a header'''
+  def __init__(self, name: str, *args, **kwargs):
+    self.name = name
+    self._blocks: List[SharedMemory] = []
+    self._header_block = _create(name, len(HEADER_FIELDS)*np.dtype(np.int64).itemsize)
+    self._header = np.ndarray(
+      (len(HEADER_FIELDS),), dtype=np.int64, buffer=self._header_block.buf)
+    self._header[:] = 0
+    super().__init__(*args, **kwargs)
+
+  def _allocate_data(self, max_rows: int) -> np.ndarray:
+    generation = int(self._header[HEADER['generation']]) + 1
+    nbytes = max_rows * self._num_columns * np.dtype(self._dtype).itemsize
+    block = _create(_data_block_name(self.name, generation), max(nbytes, 1))
+    data = np.ndarray((max_rows, self._num_columns), dtype=self._dtype, buffer=block.buf)
+    data[:] = 0
+    self._blocks.append(block)
+
+    self._header[HEADER['capacity']] = max_rows
+    self._header[HEADER['num_columns']] = self._num_columns
+    self._header[HEADER['dtype']] = ord(np.dtype(self._dtype).char)
+    self._header[HEADER['generation']] = generation
+    return data
+
+  def _expand(self, max_rows: int):
+    super()._expand(max_rows)
+    self._release_old_blocks()
+    self._publish_live_count()
+
+  def restore(self, snapshot):
+    super().restore(snapshot)
+    self._release_old_blocks()
+    self._publish_live_count()
+
+  def _release_old_blocks(self):
+    # Rows now live in the newest block. Readers still mapping an older
+    # one keep it alive until they remap, since unlinking only drops the name
+    while len(self._blocks) > 1:
+      _release(self._blocks.pop(0))
+
+  def add_row(self) -> int:
+    row_id = super().add_row()
+    self._publish_live_count()
+    return row_id
+
+  def remove_row(self, row_id: int) -> int:
+    super().remove_row(row_id)
+    self._publish_live_count()
+
+  def _publish_live_count(self):
+    # Row 0 is padding and never allocated
+    self._header[HEADER['live_count']] = \
+      self._max_rows - 1 - len(self._id_allocator.free)
+
+  def close(self):
+    '''Unlink the shared memory blocks. The table is unusable afterwards'''
+    self._data = None
+    self._header = None
+    for block in self._blocks + [self._header_block]:
+      _release(block)
+    self._blocks = []
+
+class SharedNumpyTable(SharedTableMixin, NumpyTable):
+  pass
+
+class SharedNumpyGridTable(SharedTableMixin, NumpyGridTable):
+  pass
+
+class SharedNumpyDatastore(NumpyDatastore):
+  '''NumpyDatastore whose tables can be read from other processes
+
+  Pass its name to SharedDatastoreReader in the reading process'''
+  def __init__(self, name: str = None) -> None:
+    super().__init__()
+    self.name = name or f'nmmo_{os.getpid()}_{uuid.uuid4().hex[:8]}'
+
+  def register_object_type(self, object_type: str, num_colums: int, **table_kwargs):
+    super().register_object_type(
+      object_type, num_colums, name=f'{self.name}_{object_type}', **table_kwargs)
+
+  def _create_table(self, num_columns: int, grid=None, dtype=np.float32,
+                    compact: bool = False, name: str = None):
+    if grid is not None:
+      size, row_idx, col_idx = grid
+      return SharedNumpyGridTable(name, num_columns, size, row_idx, col_idx, dtype=dtype)
+    return SharedNumpyTable(name, num_columns, 100, dtype, compact)
+
+  def close(self):
+    for table in self._tables.values():
+      table.close()
+    self._tables = {}
+
+class SharedTableReader(NumpyTable):
+  '''Read-only NumpyTable over a table published by a SharedNumpyDatastore
+
+  Supports the read queries of NumpyTable by scanning the mapped rows.
+  The writer's secondary indices are process-local and not shared'''
+  # pylint: disable=super-init-not-called
+  def __init__(self, name: str):
+    self.name = name
+    self._header_block = _attach(name)
+    self._header = np.ndarray(
+      (len(HEADER_FIELDS),), dtype=np.int64, buffer=self._header_block.buf)
+    self._num_columns = int(self._header[HEADER['num_columns']])
+    self._generation = None
+    self._data_block = None
+    self._mapped = None
+
+    self._compact = False
+    self._spatial_index = None
+    self._hash_indices = {}
+    self._dirty = None
+
+  @property
+  def _data(self) -> np.ndarray:
+    generation = int(self._header[HEADER['generation']])
+    if generation != self._generation:
+      block = _attach(_data_block_name(self.name, generation))
+      shape = (int(self._header[HEADER['capacity']]), self._num_columns)
+      dtype = np.dtype(chr(self._header[HEADER['dtype']]))
+      self._mapped = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+      self._mapped.flags.writeable = False
+      if self._data_block is not None:
+        _close(self._data_block)
+      self._data_block = block
+      self._generation = generation
+    return self._mapped
+
+  @property
+  def live_count(self) -> int:
+    return int(self._header[HEADER['live_count']])
+
+  def update(self, row_id: int, col: int, value):
+    raise TypeError('Shared table readers are read-only')
+
+  def update_column(self, row_ids, col: int, values):
+    raise TypeError('Shared table readers are read-only')
+
+  def add_row(self) -> int:
+    raise TypeError('Shared table readers are read-only')
+
+  def remove_row(self, row_id: int) -> int:
+    raise TypeError('Shared table readers are read-only')
+
+  def is_empty(self) -> bool:
+    return self.live_count == 0
+
+  def close(self):
+    self._mapped = None
+    if self._data_block is not None:
+      _close(self._data_block)
+    self._header = None
+    _close(self._header_block)
+
+class SharedDatastoreReader:
+  '''Maps the tables of a SharedNumpyDatastore, e.g. in a worker process
+
+  Tables are queried through the usual State.Query lambdas'''
+  def __init__(self, name: str) -> None:
+    self.name = name
+    self._tables: Dict[str, SharedTableReader] = {}
+
+  def table(self, object_type: str) -> SharedTableReader:
+    if object_type not in self._tables:
+      self._tables[object_type] = SharedTableReader(f'{self.name}_{object_type}')
+    return self._tables[object_type]
+
+  def close(self):
+    for table in self._tables.values():
+      table.close()
+    self._tables = {}
+
+def _create(name: str, size: int) -> SharedMemory:
+  return SharedMemory(name=name, create=True, size=size)
+
+def _release(block: SharedMemory):
+  try:
+    block.unlink()
+  except FileNotFoundError:
+    # Already unlinked by the resource tracker of an unrelated reader process
+    pass
+  _close(block)
+
+def _close(block: SharedMemory):
+  try:
+    block.close()
+  except BufferError:
+    # Arrays handed out earlier still view the block, which then stays
+    # mapped until they are collected
+    pass
+
+def _attach(name: str) -> SharedMemory:
+  # Only the creator should unlink blocks, so readers stay out of the resource
+  # tracker where possible (Python 3.13+). Before that, attaching registers the
+  # block again, which is harmless in multiprocessing workers since they share
+  # the creator's tracker. Unrelated processes would unlink it when they exit
+  try:
+    return SharedMemory(name=name, track=False) # pylint: disable=unexpected-keyword-arg
+  except TypeError:
+    return SharedMemory(name=name)
@@ -77,6 +77,16 @@ EntityState.Limits = lambda config: {
   } if config.PROGRESSION_SYSTEM_ENABLED else {}),
 }
 
+# Ids and unbounded counters need 32 bits; levels and resources fit in 16
+EntityState.Dtypes = {
+  **{attr: np.int16 for attr in EntityState.State.attr_name_to_col},
+  "id": np.int32,
+  "damage": np.int32,
+  "time_alive": np.int32,
+  "attacker_id": np.int32,
+  "gold": np.int32,
+}
+
 EntityState.Query = SimpleNamespace(
   # Whole table
   table=lambda ds: ds.table("Entity").where_neq(
@@ -95,6 +105,12 @@ EntityState.Query = SimpleNamespace(
     EntityState.State.attr_name_to_col["row"],
     EntityState.State.attr_name_to_col["col"],
     r, c, radius),
+
+  # Entities in a radius around each of many positions
+  window_batch=lambda ds, rs, cs, radius: ds.table("Entity").window_batch(
+    EntityState.State.attr_name_to_col["row"],
+    EntityState.State.attr_name_to_col["col"],
+    rs, cs, radius),
 )
 
 class Resources:
@@ -45,6 +45,7 @@ class EntityGroup(Mapping):
 
   def reset(self):
     for ent in self.entities.values():
+      self.realm.map.tiles[ent.pos].remove_entity(ent.ent_id)
       ent.datastore_record.delete()
 
     self.entities = {}
@@ -525,7 +525,7 @@ class MarketItem(Node):
 
   def deserialize(realm, entity, index: int):
     # NOTE: index is from the market, NOT item id
-    market = Item.Query.for_sale(realm.datastore)
+    market = realm.exchange.for_sale()
 
     if index >= market.shape[0]:
       return None
@@ -619,8 +619,11 @@ def init_discrete(values):
   classes = []
   for i in values:
     name = f'Discrete_{i}'
-    cls  = type(name, (object,), {'val': i})
-    classes.append(cls)
+    # Reuse and register the class at module level, so that each value
+    # maps to one class that pickles by reference, e.g. in checkpoints
+    if name not in globals():
+      globals()[name] = type(name, (object,), {'val': i, '__module__': __name__})
+    classes.append(globals()[name])
 
   return classes
 
@@ -30,6 +30,11 @@ class PriorityQueue:
          self.items.remove(item)
       return priority, item
 
+   @property
+   def nextPriority(self):
+      if len(self.q) > 0:
+         return self.q[0][0]
+
    @property
    def peek(self):
       return self.peekPriority, self.peekValue
@@ -1,5 +1,6 @@
 # pylint: disable=all
 
+import functools
 import inspect
 from collections import deque
 
@@ -16,6 +17,24 @@ class classproperty(object):
   def __get__(self, obj, owner):
     return self.f(owner)
 
+def memoize(method):
+  '''Caches the results of a method on its instance, by arguments
+
+  Unlike functools.lru_cache on a method, the cache does not reference
+  the instance and is freed along with it'''
+  name = f'_memo_{method.__name__}'
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+    cache = self.__dict__.get(name)
+    if cache is None:
+      cache = self.__dict__[name] = {}
+    if key not in cache:
+      cache[key] = method(self, *args, **kwargs)
+    return cache[key]
+  return wrapper
+
 class Iterable(type):
   def __iter__(cls):
     queue = deque(cls.__dict__.items())
@@ -4,6 +4,8 @@ import math
 
 from typing import Dict
 
+import numpy as np
+
 from nmmo.systems.item import Item, Stack
 
 """
@@ -16,6 +18,11 @@ exchange, and the unlist_item() method is used to remove
 an item from the exchange. The step() method is used to
 regularly check and remove expired listings.
 
+Since these are the only writers of listed_price, the exchange
+also keeps a contiguous array of the listed Item table rows.
+The for_sale() method returns the market from these rows in
+O(listings), rather than scanning the whole Item table.
+
 The sell() method allows a player to sell an item, and the buy() method
 allows a player to purchase an item. The packet property returns a
 dictionary that contains information about the items currently being
@@ -37,10 +44,19 @@ class Exchange:
     self._realm = realm
     self._config = realm.config
 
+    # Item table rows of the listings, packed into _listed_rows[:_num_listed].
+    # _listed_slot is keyed by item id, and _listed_ids holds the item id
+    # of each slot, so that slots can be moved without mapping rows to ids
+    self._listed_rows = np.zeros(16, dtype=np.int64)
+    self._listed_ids = np.zeros(16, dtype=np.int64)
+    self._listed_slot: Dict[int, int] = {} # item_id -> index in _listed_rows
+    self._num_listed = 0
+
   def _list_item(self, item: Item, seller, price: int, tick: int):
     item.listed_price.update(price)
     self._item_listings[item.id.val] = ItemListing(item, seller, price, tick)
     self._listings_queue.append((item.id.val, tick))
+    self._add_listed_row(item)
 
   def unlist_item(self, item: Item):
     if item.id.val in self._item_listings:
@@ -49,6 +65,38 @@ class Exchange:
   def _unlist_item(self, item_id: int):
     item = self._item_listings.pop(item_id).item
     item.listed_price.update(0)
+    self._remove_listed_row(item_id)
+
+  def _add_listed_row(self, item: Item):
+    if item.id.val in self._listed_slot:
+      return # re-listed item
+
+    if self._num_listed == len(self._listed_rows):
+      self._listed_rows = np.concatenate([self._listed_rows, np.zeros_like(self._listed_rows)])
+      self._listed_ids = np.concatenate([self._listed_ids, np.zeros_like(self._listed_ids)])
+
+    self._listed_rows[self._num_listed] = item.datastore_record.id
+    self._listed_ids[self._num_listed] = item.id.val
+    self._listed_slot[item.id.val] = self._num_listed
+    self._num_listed += 1
+
+  def _remove_listed_row(self, item_id: int):
+    # Swap the last listed row into the freed slot to stay contiguous
+    slot = self._listed_slot.pop(item_id)
+    self._num_listed -= 1
+    last = self._num_listed
+    if slot != last:
+      self._listed_rows[slot] = self._listed_rows[last]
+      self._listed_ids[slot] = self._listed_ids[last]
+      self._listed_slot[int(self._listed_ids[last])] = slot
+
+  def for_sale(self):
+    '''Item table rows of all listed items
+
+    Equivalent to Item.Query.for_sale, including the row id order that
+    market action indices refer to, but only touches the listed rows'''
+    rows = np.sort(self._listed_rows[:self._num_listed])
+    return Item.State.table(self._realm.datastore).get(rows)
 
   def step(self, current_tick: int):
     """
@@ -5,6 +5,8 @@ import math
 from types import SimpleNamespace
 from typing import Dict
 
+import numpy as np
+
 from nmmo.lib.colors import Tier
 from nmmo.datastore.serialized import SerializedState
 
@@ -51,6 +53,15 @@ ItemState.Limits = lambda config: {
   "listed_price": (0, math.inf),
 }
 
+ItemState.Dtypes = {
+  **{attr: np.int16 for attr in ItemState.State.attr_name_to_col},
+  "id": np.int32,
+  "owner_id": np.int32,
+  "quantity": np.int32,
+  "listed_price": np.int32,
+  "equipped": np.uint8,
+}
+
 ItemState.Query = SimpleNamespace(
   table=lambda ds: ds.table("Item").where_neq(
     ItemState.State.attr_name_to_col["id"], 0),
@@ -61,6 +72,9 @@ ItemState.Query = SimpleNamespace(
   owned_by = lambda ds, id: ds.table("Item").where_eq(
     ItemState.State.attr_name_to_col["owner_id"], id),
 
+  owned_by_batch = lambda ds, ids: ds.table("Item").where_eq_batch(
+    ItemState.State.attr_name_to_col["owner_id"], ids),
+
   for_sale = lambda ds: ds.table("Item").where_neq(
     ItemState.State.attr_name_to_col["listed_price"], 0),
 )
@@ -44,14 +44,17 @@ def pathfind(config, ob, actions, rr, cc):
    actions[action.Move] = {action.Direction: direction}
 
 def meander(config, ob, actions):
+   habitable = ob.local_tiles().habitable
+   vision = config.PLAYER_VISION_RADIUS
+
    cands = []
-   if ob.tile(-1, 0).material_id in material.Habitable:
+   if habitable[vision - 1, vision]:
       cands.append((-1, 0))
-   if ob.tile(1, 0).material_id in material.Habitable:
+   if habitable[vision + 1, vision]:
       cands.append((1, 0))
-   if ob.tile(0, -1).material_id in material.Habitable:
+   if habitable[vision, vision - 1]:
       cands.append((0, -1))
-   if ob.tile(0, 1).material_id in material.Habitable:
+   if habitable[vision, vision + 1]:
       cands.append((0, 1))
    if not cands:
       return (-1, 0)
@@ -82,6 +85,7 @@ def evade(config, ob: Observation, actions, attacker):
 
 def forageDijkstra(config, ob: Observation, actions, food_max, water_max, cutoff=100):
    vision = config.PLAYER_VISION_RADIUS
+   tiles  = ob.local_tiles()
 
    agent  = ob.agent()
    food = agent.food
@@ -109,10 +113,9 @@ def forageDijkstra(config, ob: Observation, actions, food_max, water_max, cutoff
          if not inSight(*nxt, vision):
             continue
 
-         tile     = ob.tile(*nxt)
-         matl     = tile.material_id
+         matl     = tiles.material_id[nxt[0] + vision, nxt[1] + vision]
 
-         if not matl in material.Habitable:
+         if not tiles.habitable[nxt[0] + vision, nxt[1] + vision]:
             continue
 
          food, water = reward[cur]
@@ -125,8 +128,7 @@ def forageDijkstra(config, ob: Observation, actions, food_max, water_max, cutoff
             if not inSight(*pos, vision):
                continue
 
-            tile = ob.tile(*pos)
-            matl = tile.material_id
+            matl = tiles.material_id[pos[0] + vision, pos[1] + vision]
 
             if matl == material.Water.index:
                water = min(water+water_max//2, water_max)
@@ -150,13 +152,13 @@ def forageDijkstra(config, ob: Observation, actions, food_max, water_max, cutoff
 
 def findResource(config, ob: Observation, resource):
     vision = config.PLAYER_VISION_RADIUS
+    materials = ob.local_tiles().material_id
 
     resource_index = resource.index
 
     for r in range(-vision, vision+1):
         for c in range(-vision, vision+1):
-            tile = ob.tile(r, c)
-            material_id = tile.material_id
+            material_id = materials[r + vision, c + vision]
 
         if material_id == resource_index:
             return (r, c)
@@ -179,6 +181,7 @@ def gatherAStar(config, ob, actions, resource, cutoff=100):
 
 def gatherBFS(config, ob: Observation, actions, resource, cutoff=100):
     vision = config.PLAYER_VISION_RADIUS
+    tiles  = ob.local_tiles()
 
     start  = (0, 0)
 
@@ -203,15 +206,14 @@ def gatherBFS(config, ob: Observation, actions, resource, cutoff=100):
             if not inSight(*nxt, vision):
                 continue
 
-            tile     = ob.tile(*nxt)
-            matl     = tile.material_id
+            matl     = tiles.material_id[nxt[0] + vision, nxt[1] + vision]
 
             if material.Fish in resource and material.Fish.index == matl:
                 found = nxt
                 backtrace[nxt] = cur
                 break
 
-            if not tile.material_id in material.Habitable:
+            if not tiles.habitable[nxt[0] + vision, nxt[1] + vision]:
                 continue
 
             if matl in (e.index for e in resource):
@@ -223,8 +225,7 @@ def gatherBFS(config, ob: Observation, actions, resource, cutoff=100):
                 if not inSight(*pos, vision):
                     continue
 
-                tile = ob.tile(*pos)
-                matl = tile.material_id
+                matl = tiles.material_id[pos[0] + vision, pos[1] + vision]
 
                 if matl == material.Fish.index:
                     backtrace[nxt] = cur
@@ -249,6 +250,7 @@ def gatherBFS(config, ob: Observation, actions, resource, cutoff=100):
 
 def aStar(config, ob: Observation, actions, rr, cc, cutoff=100):
    vision = config.PLAYER_VISION_RADIUS
+   tiles  = ob.local_tiles()
 
    start = (0, 0)
    goal  = (rr, cc)
@@ -282,14 +284,11 @@ def aStar(config, ob: Observation, actions, rr, cc, cutoff=100):
          if not inSight(*nxt, vision):
             continue
 
-         tile     = ob.tile(*nxt)
-         matl     = tile.material_id
-
-         if not matl in material.Habitable:
+         if not tiles.habitable[nxt[0] + vision, nxt[1] + vision]:
            continue
 
          #Omitted water from the original implementation. Seems key
-         if matl in material.Impassible:
+         if tiles.impassible[nxt[0] + vision, nxt[1] + vision]:
             continue
 
          newCost = cost[cur] + 1
@@ -1,15 +1,24 @@
 
 import unittest
+import gc
+import weakref
 from typing import List
 
 import random
+import numpy as np
 from tqdm import tqdm
 
+# pylint: disable=import-error
+from testhelpers import observations_are_equal
+
 import nmmo
+from nmmo.core.observation import Observation, make_action_targets_batch
 from nmmo.core.realm import Realm
 from nmmo.core.tile import TileState
 from nmmo.entity.entity import Entity, EntityState
+from nmmo.io import action
 from nmmo.systems.item import ItemState
+from nmmo.lib import material
 from scripted import baselines
 
 # Allow private access for testing
@@ -28,6 +37,15 @@ class Config(nmmo.config.Small, nmmo.config.AllGameSystems):
     baselines.Carver, baselines.Alchemist,
     baselines.Melee, baselines.Range, baselines.Mage]
 
+def rollout(config):
+  '''Reseed and run an Env for TEST_HORIZON steps, returning it and the
+  observations of each tick. Each tick's observations are copied into a
+  dict when they are returned, so lazy ones are read before the next step'''
+  random.seed(RANDOM_SEED)
+  env = nmmo.Env(config, RANDOM_SEED)
+  obs = [dict(env.reset())] + [dict(env.step({})[0]) for _ in range(TEST_HORIZON)]
+  return env, obs
+
 class TestEnv(unittest.TestCase):
   @classmethod
   def setUpClass(cls):
@@ -150,5 +168,104 @@ class TestEnv(unittest.TestCase):
 
     self.assertTrue(ItemState.State.table(new_env.realm.datastore).is_empty())
 
+  def test_local_tiles(self):
+    self.env.reset()
+    self.env.step({})
+    radius = self.config.PLAYER_VISION_RADIUS
+    for player_id, player_obs in self.env.obs.items():
+      grid = player_obs.local_tiles()
+      agent = self.env.realm.players[player_id]
+      for r_delta in range(-radius, radius + 1):
+        for c_delta in range(-radius, radius + 1):
+          tile = self.env.realm.map.tiles[agent.row.val + r_delta, agent.col.val + c_delta]
+          material_id = grid.material_id[r_delta + radius, c_delta + radius]
+          self.assertEqual(material_id, tile.material_id.val)
+          self.assertEqual(player_obs.tile(r_delta, c_delta).material_id, material_id)
+          self.assertEqual(grid.habitable[r_delta + radius, c_delta + radius],
+                           material_id in material.Habitable)
+
+      with self.assertRaises(IndexError):
+        player_obs.tile(radius + 1, 0)
+
+  def test_observations_are_freed(self):
+    self.env.reset()
+    obs = next(iter(self.env.obs.values()))
+    obs.tile(0, 0)
+    obs.agent()
+    ref = weakref.ref(obs)
+    del obs
+
+    # scripted agents hold on to the observation they last acted on
+    self.env.step({})
+    self.env.step({})
+    gc.collect()
+    self.assertIsNone(ref())
+
+  def test_obs_buffers(self):
+    src = rollout(self.config)[1][-1]
+    config = Config()
+    config.PROVIDE_OBS_BUFFERS = True
+    env, obs = rollout(config)
+    obs = obs[-1]
+
+    self.assertEqual(src.keys(), obs.keys())
+    for agent_id, agent_obs in obs.items():
+      for key, arr in env._obs_buffers.arrays.items():
+        self.assertIs(agent_obs[key].base, arr)
+        # rows left by longer earlier observations were zeroed
+        np.testing.assert_array_equal(agent_obs[key], src[agent_id][key])
+
+  def test_lazy_observations(self):
+    config = Config()
+    config.PROVIDE_ACTION_TARGETS = True
+    _, src = rollout(config)
+    config.PROVIDE_LAZY_OBS = True
+    config.PROVIDE_LAZY_OBS_QUERIES = True
+    env, lazy = rollout(config)
+
+    for src_obs, lazy_obs in zip(src, lazy):
+      self.assertTrue(observations_are_equal(src_obs, lazy_obs))
+      for agent_id, agent_obs in src_obs.items():
+        for atn, args in agent_obs["ActionTargets"].items():
+          for arg, mask in args.items():
+            np.testing.assert_array_equal(mask, lazy_obs[agent_id]["ActionTargets"][atn][arg])
+
+    # lazy observations are not converted after the next step
+    obs = env.step({})[0]
+    env.step({})
+    with self.assertRaises(AssertionError):
+      obs[next(iter(obs))] # pylint: disable=expression-not-assigned
+
+  def test_action_targets_batch(self):
+    config = Config()
+    config.PROVIDE_ACTION_TARGETS = True
+    env = nmmo.Env(config, RANDOM_SEED)
+    env.reset()
+    for _ in tqdm(range(TEST_HORIZON)):
+      env.step({})
+      for agent_obs in env.obs.values():
+        batch = agent_obs.action_targets
+        for atn, args in agent_obs._make_action_targets().items():
+          self.assertSetEqual(set(args.keys()), set(batch[atn].keys()))
+          for arg, mask in args.items():
+            self.assertEqual(mask.dtype, batch[atn][arg].dtype)
+            np.testing.assert_array_equal(mask, batch[atn][arg])
+
+    # at the map edge, the tiles past it are not observed and cannot be moved to
+    agent_obs = next(iter(env.obs.values()))
+    agent = agent_obs.agent()
+    tiles = agent_obs.tiles
+    tile_row = tiles[:, TileState.State.attr_name_to_col["row"]]
+    own_tile = (tile_row == agent.row) & \
+               (tiles[:, TileState.State.attr_name_to_col["col"]] == agent.col)
+    # the own tile comes first, so a missing neighbor does not alias row 0
+    edge_tiles = np.concatenate([tiles[own_tile], tiles[~own_tile & (tile_row >= agent.row)]])
+    edge_obs = Observation(config, agent_obs.agent_id, edge_tiles, agent_obs.entities.values,
+                           agent_obs.inventory.values, agent_obs.market.values)
+    batch = make_action_targets_batch(config, [edge_obs])[0]
+    move = edge_obs._make_action_targets()[action.Move][action.Direction]
+    np.testing.assert_array_equal(move, batch[action.Move][action.Direction])
+    self.assertEqual(move[action.Direction.edges.index(action.North)], 0)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+
+import os
+import tempfile
+import numpy as np
+
+import nmmo
+from nmmo.core.terrain import MapGenerator, Terrain, spawn_profession_resources
+from nmmo.core.tile import TileState
+from nmmo.lib import material
+
+# Terrain material indices are assigned with setattr()
+# pylint: disable=no-member
+
+class Config(nmmo.config.Small, nmmo.config.AllGameSystems):
+  pass
+
+class TileViewConfig(Config):
+  MAP_TILE_VIEWS = True
+
+class CustomMapGenerator:
+  '''User-supplied generator without MapGenerator.map_path'''
+  def __init__(self, config):
+    self.generator = MapGenerator(config)
+
+  def generate_all_maps(self):
+    self.generator.generate_all_maps()
+
+class FailingMapGenerator(MapGenerator):
+  '''Generator that fails after starting to write a map'''
+  def save_map(self, idx, path):
+    with open(os.path.join(path, 'map.npy'), 'wb'):
+      pass
+    raise IOError('disk full')
+
+class CustomGeneratorConfig(Config):
+  MAP_GENERATOR = CustomMapGenerator
+
+class TestMap(unittest.TestCase):
+  def _check_reload(self, config):
+    env = nmmo.Env(config, seed=0)
+    env.reset(map_id=1)
+    realm = env.realm
+    map_file = realm.map.materials
+
+    # deplete a resource tile, then reload the same map
+    r, c = np.argwhere(map_file == material.Forest.index)[0]
+    realm.map.harvest(r, c)
+    self.assertEqual(realm.map.tiles[r, c].material_id.val, material.Scrub.index)
+    env.reset(map_id=1)
+
+    tile = realm.map.tiles[r, c]
+    self.assertFalse(tile.depleted)
+    self.assertEqual(tile.state.index, material.Forest.index)
+    self.assertEqual(tile.material_id.val, material.Forest.index)
+    self.assertEqual(len(realm.map.update_list), 0)
+
+    # the Tile table holds the map, and only live entities occupy tiles
+    row_ids = np.arange(1, config.MAP_SIZE**2 + 1)
+    tiles = TileState.State.table(realm.datastore).get(row_ids)
+    np.testing.assert_array_equal(
+      tiles[:, TileState.State.attr_name_to_col["material_id"]], map_file.ravel())
+    occupants = sorted(ent_id for row in realm.map.tiles for t in row for ent_id in t.entities)
+    self.assertListEqual(occupants, sorted([*realm.players.keys(), *realm.npcs.keys()]))
+
+  def test_reload_tiles(self):
+    self._check_reload(Config())
+
+  def test_reload_tile_views(self):
+    self._check_reload(TileViewConfig())
+
+  def _check_respawn(self, config):
+    env = nmmo.Env(config, seed=0)
+    env.reset(map_id=1)
+    realm = env.realm
+    forest = [tuple(pos) for pos in np.argwhere(realm.map.materials == material.Forest.index)]
+    for r, c in forest:
+      realm.map.harvest(r, c)
+    self.assertListEqual([t.pos for t in realm.map.update_list], forest)
+
+    # one draw per depleted tile, in order of depletion
+    np.random.seed(1)
+    expected = np.random.rand(len(forest)) <= config.RESOURCE_FOREST_RESPAWN
+    np.random.seed(1)
+    realm.map.step()
+    for pos, respawned in zip(forest, expected):
+      tile = realm.map.tiles[pos]
+      self.assertEqual(tile.depleted, not respawned)
+      self.assertEqual(tile.material_id.val,
+        material.Forest.index if respawned else material.Scrub.index)
+
+    # respawned tiles stay listed until the next step
+    self.assertEqual(len(realm.map.update_list), len(forest))
+    realm.map.step()
+    listed = {tile.pos for tile in realm.map.update_list}
+    for pos, respawned in zip(forest, expected):
+      self.assertEqual(pos in listed, not respawned)
+
+  def test_respawn_tiles(self):
+    self._check_respawn(Config())
+
+  def test_respawn_tile_views(self):
+    self._check_respawn(TileViewConfig())
+
+  def test_scheduled_respawn(self):
+    config = Config()
+    config.MAP_SCHEDULE_RESPAWNS = True
+    env = nmmo.Env(config, seed=0)
+    env.reset(map_id=1)
+    realm = env.realm
+    forest = [tuple(pos) for pos in np.argwhere(realm.map.materials == material.Forest.index)]
+    for r, c in forest:
+      realm.map.harvest(r, c)
+
+    # respawn ticks are sampled once, counting the step that merges the harvest
+    np.random.seed(1)
+    due = realm.tick + np.random.geometric(config.RESOURCE_FOREST_RESPAWN, len(forest)) - 1
+    np.random.seed(1)
+    start = realm.tick
+    for tick in range(start, due.max() + 1):
+      realm.tick = tick
+      realm.map.step()
+      for pos, respawn in zip(forest, due):
+        self.assertEqual(realm.map.tiles[pos].depleted, respawn > tick)
+
+    self.assertListEqual(realm.map.respawn_schedule, [])
+    realm.map.step()
+    self.assertEqual(len(realm.map.update_list), 0)
+
+  def test_map_cache(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      config = Config()
+      config.PATH_MAPS = os.path.join(tmp, 'maps')
+      config.MAP_N = 2
+      generator = config.MAP_GENERATOR(config)
+      generator.generate_all_maps()
+
+      config = Config()
+      config.PATH_MAPS = os.path.join(tmp, 'maps')
+      config.MAP_N = 2
+      config.MAP_CACHE = True
+      cached = config.MAP_GENERATOR(config)
+      cached.generate_all_maps()
+      self.assertNotEqual(cached.fingerprint(0), cached.fingerprint(1))
+      for map_id in [1, 2]:
+        self.assertTrue(cached.map_path(map_id).startswith(os.path.join(tmp, 'maps', 'cache')))
+        np.testing.assert_array_equal(
+          np.load(generator.map_path(map_id)), np.load(cached.map_path(map_id)))
+
+      # cached maps are reused, and only a config change generates new ones
+      mtime = os.path.getmtime(cached.map_path(1))
+      cached.generate_all_maps()
+      self.assertEqual(mtime, os.path.getmtime(cached.map_path(1)))
+
+      # no lock files are left next to the cached maps
+      self.assertEqual(
+        [name for name in os.listdir(os.path.join(tmp, 'maps', 'cache'))
+         if name.endswith('.lock')], [])
+
+      fingerprint = cached.fingerprint(0)
+      config.MAP_N = 3
+      self.assertEqual(fingerprint, cached.fingerprint(0))
+      config.TERRAIN_WATER = 0.2
+      self.assertNotEqual(fingerprint, cached.fingerprint(0))
+
+      env = nmmo.Env(config, seed=0)
+      env.reset(map_id=1)
+      self.assertTrue(os.path.exists(env.realm.map_generator.map_path(1)))
+
+  def test_failed_cached_map(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      config = Config()
+      config.PATH_MAPS = os.path.join(tmp, 'maps')
+      config.MAP_N = 1
+      config.MAP_CACHE = True
+      generator = FailingMapGenerator(config)
+      with self.assertRaises(IOError):
+        generator.generate_all_maps()
+
+      # the partial map is removed and nothing is left in the cache
+      self.assertEqual(os.listdir(os.path.join(tmp, 'maps', 'cache')), [])
+
+  def test_parallel_generation(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      maps = []
+      # spawned workers do not inherit state set up by the parent
+      for workers, start_method in [(1, None), (2, None), (2, 'spawn')]:
+        config = Config()
+        config.PATH_MAPS = os.path.join(tmp, f'maps{workers}_{start_method}')
+        config.MAP_N = 3
+        config.MAP_GENERATION_WORKERS = workers
+        config.MAP_GENERATION_START_METHOD = start_method
+        generator = config.MAP_GENERATOR(config)
+        generator.generate_all_maps()
+        maps.append([np.load(generator.map_path(map_id)) for map_id in [1, 2, 3]])
+        self.assertEqual(maps[-1][0].dtype, np.uint8)
+
+      for serial, parallel, spawned in zip(*maps):
+        np.testing.assert_array_equal(serial, parallel)
+        np.testing.assert_array_equal(serial, spawned)
+
+  def test_resource_placement_without_grass(self):
+    config = Config()
+    size = config.MAP_SIZE
+    tiles = np.full((size, size), Terrain.WATER)
+    tiles[size//2, size//2:size//2 + 3] = Terrain.GRASS
+
+    # runs out of grass instead of retrying forever
+    with self.assertLogs(level='WARNING'):
+      spawn_profession_resources(config, tiles, 0)
+    self.assertFalse(np.any(tiles == Terrain.GRASS))
+    self.assertEqual(np.sum(tiles == Terrain.FISH), 0)
+
+  def test_custom_map_generator(self):
+    config = CustomGeneratorConfig()
+    env = nmmo.Env(config, seed=0)
+    env.reset(map_id=1)
+    np.testing.assert_array_equal(
+      env.realm.map.materials, np.load(MapGenerator(config).map_path(1)))
+
+if __name__ == '__main__':
+  unittest.main()
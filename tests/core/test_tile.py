@@ -1,6 +1,7 @@
 import unittest
+import numpy as np
 import nmmo
-from nmmo.core.tile import Tile, TileState
+from nmmo.core.tile import Tile, TileGrid, TileState
 from nmmo.datastore.numpy_datastore import NumpyDatastore
 from nmmo.lib import material
 
@@ -35,5 +36,37 @@ class TestTile(unittest.TestCase):
     self.assertEqual(tile.depleted, True)
     self.assertEqual(tile.material_id.val, material.Scrub.index)
 
+  def test_tile_view(self):
+    mock_realm = MockRealm()
+    size = mock_realm.config.MAP_SIZE
+    grid = TileGrid(mock_realm)
+    map_file = np.full((size, size), material.Grass.index)
+    map_file[10, 20] = material.Forest.index
+    grid.reset(map_file)
+
+    tile = grid[10, 20]
+    self.assertEqual(tile.row.val, 10)
+    self.assertEqual(tile.col.val, 20)
+    self.assertEqual(tile.material_id.val, material.Forest.index)
+    self.assertTrue(tile.habitable)
+    self.assertEqual(tile, grid[10, 20])
+    self.assertEqual(len({tile, grid[10, 20], grid[10, 21]}), 2)
+    self.assertEqual(grid[-1, -1], grid[size-1, size-1])
+
+    tile.add_entity(MockEntity(1))
+    tile.add_entity(MockEntity(2))
+    self.assertCountEqual(grid[10, 20].entities.keys(), [1, 2])
+    tile.remove_entity(1)
+    self.assertCountEqual(grid[10, 20].entities.keys(), [2])
+
+    grid[10, 20].harvest(True)
+    self.assertEqual(tile.depleted, True)
+    self.assertEqual(tile.material_id.val, material.Scrub.index)
+    self.assertEqual(type(tile.material), material.Forest)
+
+    # the Tile table follows the grids
+    row = mock_realm.datastore.table("Tile").get([10*size + 20 + 1])[0]
+    self.assertListEqual(row.tolist(), [10, 20, material.Scrub.index])
+
 if __name__ == '__main__':
     unittest.main()
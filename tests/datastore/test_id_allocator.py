@@ -1,6 +1,6 @@
 import unittest
 
-from nmmo.datastore.id_allocator import IdAllocator
+from nmmo.datastore.id_allocator import CompactIdAllocator, IdAllocator
 
 class TestIdAllocator(unittest.TestCase):
   def test_id_allocator(self):
@@ -60,5 +60,38 @@ class TestIdAllocator(unittest.TestCase):
     id_allocator.remove(10)
     self.assertEqual(id_allocator.allocate(), 10)
 
+  def test_fifo_order(self):
+    id_allocator = IdAllocator(10)
+    for _ in range(1, 10):
+      id_allocator.allocate()
+
+    for row_id in [7, 2, 7, 4]:
+      id_allocator.remove(row_id)
+    self.assertEqual([id_allocator.allocate() for _ in range(3)], [7, 2, 4])
+    self.assertTrue(id_allocator.full())
+
+  def test_compact_id_allocator(self):
+    id_allocator = CompactIdAllocator(10)
+    for i in range(1, 10):
+      self.assertEqual(id_allocator.allocate(), i)
+    self.assertEqual(id_allocator.live_end, 10)
+
+    for row_id in [7, 2, 9, 4]:
+      id_allocator.remove(row_id)
+    self.assertEqual(id_allocator.live_end, 9)
+
+    # the lowest free id is reused first
+    self.assertEqual([id_allocator.allocate() for _ in range(2)], [2, 4])
+
+    for row_id in [8, 6, 5]:
+      id_allocator.remove(row_id)
+    self.assertEqual(id_allocator.live_end, 5)
+
+    id_allocator.expand(12)
+    self.assertEqual([id_allocator.allocate() for _ in range(7)], [5, 6, 7, 8, 9, 10, 11])
+    self.assertEqual(id_allocator.live_end, 12)
+    with self.assertRaises(KeyError):
+      id_allocator.allocate()
+
 if __name__ == '__main__':
   unittest.main()
@@ -2,7 +2,7 @@ import unittest
 
 import numpy as np
 
-from nmmo.datastore.numpy_datastore import NumpyTable
+from nmmo.datastore.numpy_datastore import NumpyGridTable, NumpyTable
 
 # pylint: disable=protected-access
 class TestNumpyTable(unittest.TestCase):
@@ -43,5 +43,130 @@ class TestNumpyTable(unittest.TestCase):
       np.array([[10.1, 0, 0], [2.1, 0, 0]], dtype=np.float32)
     )
 
+  def test_spatial_index_window(self):
+    table = NumpyTable(3, 10, np.float32)
+    indexed = NumpyTable(3, 10, np.float32)
+    indexed.index_spatial(0, 1, 4)
+
+    positions = [(1, 1), (5, 5), (5, 9), (12, 3), (20, 20), (7, 6)]
+    for t in [table, indexed]:
+      for pos in positions:
+        row_id = t.add_row()
+        t.update(row_id, 0, pos[0])
+        t.update(row_id, 1, pos[1])
+        t.update(row_id, 2, row_id)
+
+    # moving and removing rows must be reflected in the index
+    for t in [table, indexed]:
+      t.update(2, 0, 19)
+      t.remove_row(4)
+
+    for row, col, radius in [(5, 5, 3), (18, 18, 2), (8, 8, 4), (13, 4, 2)]:
+      np.testing.assert_array_equal(
+        indexed.window(0, 1, row, col, radius),
+        table.window(0, 1, row, col, radius))
+
+    # window_batch reads the index's cell order rather than sorting all rows
+    for radius in [2, 3, 4]:
+      rows, cols = [5, 18, 8, 13, 9, 30], [5, 18, 8, 6, 12, 30]
+      windows = indexed.window_batch(0, 1, rows, cols, radius)
+      self.assertIsNotNone(indexed._spatial_index._by_cell)
+      for row, col, window in zip(rows, cols, windows):
+        np.testing.assert_array_equal(window, table.window(0, 1, row, col, radius))
+
+  def test_batch_queries(self):
+    table = NumpyTable(3, 10, np.float32)
+    for row, col, owner in [(5, 5, 1), (6, 2, 2), (9, 9, 1), (3, 8, 0), (6, 6, 2), (20, 1, 1)]:
+      row_id = table.add_row()
+      table.update(row_id, 0, row)
+      table.update(row_id, 1, col)
+      table.update(row_id, 2, owner)
+
+    rows, cols, radius = [5, 8, 20, 40], [5, 8, 2, 40], 2
+    for (row, col), window in zip(zip(rows, cols),
+                                  table.window_batch(0, 1, rows, cols, radius)):
+      np.testing.assert_array_equal(window, table.window(0, 1, row, col, radius))
+
+    owners = [2, 1, 7]
+    for owner, rows_owned in zip(owners, table.where_eq_batch(2, owners)):
+      np.testing.assert_array_equal(rows_owned, table.where_eq(2, owner))
+
+  def test_grid_table_window(self):
+    size = 10
+    table = NumpyTable(3, 100, np.float32)
+    grid = NumpyGridTable(3, size, 0, 1, dtype=np.float32)
+    for t in [table, grid]:
+      for r in range(size):
+        for c in range(size):
+          row_id = t.add_row()
+          t.update(row_id, 0, r)
+          t.update(row_id, 1, c)
+          t.update(row_id, 2, r*c)
+
+    self.assertEqual(grid.grid.shape, (size, size, 3))
+    with self.assertRaises(AssertionError):
+      grid.add_row()
+
+    rows, cols, radius = [3, 0, 9], [4, 6, 9], 2
+    for (row, col), window in zip(zip(rows, cols),
+                                  grid.window_batch(0, 1, rows, cols, radius)):
+      np.testing.assert_array_equal(window, table.window(0, 1, row, col, radius))
+      np.testing.assert_array_equal(window, grid.window(0, 1, row, col, radius))
+
+  def test_hash_index(self):
+    table = NumpyTable(2, 100, np.float32)
+    indexed = NumpyTable(2, 100, np.float32)
+    indexed.index_hash(1)
+
+    for t in [table, indexed]:
+      for owner in [3, 1, 3, 2, 3, 1]:
+        row_id = t.add_row()
+        t.update(row_id, 0, row_id)
+        t.update(row_id, 1, owner)
+
+      # transfer, remove and re-add rows
+      t.update(1, 1, 1)
+      t.remove_row(3)
+      t.update(t.add_row(), 1, 2)
+
+    for owner in [0, 1, 2, 3, 4]:
+      np.testing.assert_array_equal(indexed.where_eq(1, owner), table.where_eq(1, owner))
+
+    for rows, expected in zip(indexed.where_eq_batch(1, [3, 4, 1]),
+                              table.where_eq_batch(1, [3, 4, 1])):
+      np.testing.assert_array_equal(rows, expected)
+
+    indexed.reset()
+    self.assertEqual(indexed.where_eq(1, 3).shape, (0, 2))
+
+  def test_dirty_tracking(self):
+    table = NumpyTable(2, 100, np.float32)
+    table.track_dirty()
+    for _ in range(6):
+      table.update(table.add_row(), 0, 1)
+
+    np.testing.assert_array_equal(table.dirty_rows(), [1, 2, 3, 4, 5, 6])
+    table.clear_dirty()
+    self.assertEqual(len(table.dirty_rows()), 0)
+
+    table.update(5, 1, 2)
+    table.remove_row(2)
+    np.testing.assert_array_equal(table.dirty_rows(), [2, 5])
+    np.testing.assert_array_equal(table.dirty_mask([2, 5]), [[True, True], [False, True]])
+
+  def test_compact_rows(self):
+    table = NumpyTable(2, 4, np.float32, compact=True)
+    for owner in range(1, 9): # expands past the initial size
+      table.update(table.add_row(), 0, owner)
+    for row_id in [8, 7, 3, 5]:
+      table.remove_row(row_id)
+
+    # only the rows up to the last live row are scanned: 0, 3 and 5 are free
+    self.assertEqual(len(table.where_eq(0, 0)), 3)
+    np.testing.assert_array_equal(table.where_in(0, [1, 3, 4]), [[1, 0], [4, 0]])
+
+    # freed rows are refilled from the front
+    self.assertEqual(table.add_row(), 3)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,74 @@
+import multiprocessing as mp
+import unittest
+
+import numpy as np
+
+import nmmo
+from nmmo.core.tile import TileState
+from nmmo.datastore.shared_datastore import SharedDatastoreReader, SharedNumpyDatastore
+from nmmo.entity.entity import EntityState
+
+def _read_window(name, queue):
+  reader = SharedDatastoreReader(name)
+  queue.put(reader.table("Test").window(0, 1, 5, 5, 1))
+  reader.close()
+
+class TestSharedDatastore(unittest.TestCase):
+  def test_reader(self):
+    datastore = SharedNumpyDatastore()
+    datastore.register_object_type("Test", 3, dtype=np.int32)
+    table = datastore.table("Test")
+    reader = SharedDatastoreReader(datastore.name)
+
+    for i in range(10):
+      record = datastore.create_record("Test")
+      record.update(0, i)
+      record.update(1, i)
+      record.update(2, 7)
+
+    shared = reader.table("Test")
+    self.assertEqual(shared.live_count, 10)
+    np.testing.assert_array_equal(shared.where_eq(2, 7), table.where_eq(2, 7))
+    np.testing.assert_array_equal(shared.window(0, 1, 5, 5, 1), table.window(0, 1, 5, 5, 1))
+
+    # growing the table moves it to a new block, which readers follow
+    for _ in range(200):
+      datastore.create_record("Test").update(2, 8)
+    self.assertEqual(shared.live_count, 210)
+    self.assertEqual(len(shared.where_eq(2, 8)), 200)
+
+    with self.assertRaises(TypeError):
+      shared.update(1, 0, 1)
+
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_read_window, args=(datastore.name, queue))
+    proc.start()
+    np.testing.assert_array_equal(queue.get(timeout=10), table.window(0, 1, 5, 5, 1))
+    proc.join()
+
+    reader.close()
+    datastore.close()
+
+  def test_env_observations(self):
+    config = nmmo.config.Small()
+    config.DATASTORE_SHARED_MEMORY = True
+    env = nmmo.Env(config, seed=0)
+    env.reset()
+    env.step({})
+
+    reader = SharedDatastoreReader(env.realm.datastore.name)
+    radius = config.PLAYER_VISION_RADIUS
+    for agent_id, obs in env.obs.items():
+      agent = env.realm.players[agent_id]
+      np.testing.assert_array_equal(
+        obs.tiles, TileState.Query.window(reader, agent.row.val, agent.col.val, radius))
+      np.testing.assert_array_equal(
+        obs.entities.values,
+        EntityState.Query.window(reader, agent.row.val, agent.col.val, radius))
+
+    reader.close()
+    env.close()
+
+if __name__ == '__main__':
+  unittest.main()
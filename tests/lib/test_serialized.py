@@ -1,6 +1,9 @@
 from collections import defaultdict
 import unittest
 
+import numpy as np
+
+from nmmo.datastore.numpy_datastore import NumpyDatastore
 from nmmo.datastore.serialized import SerializedState
 
 # pylint: disable=no-member,unused-argument,unsubscriptable-object
@@ -52,5 +55,28 @@ class TestSerialized(unittest.TestCase):
     state.a.update(a_max + 100)
     self.assertEqual(state.a.val, a_max)
 
+  def test_storage_dtype(self):
+    BarState = SerializedState.subclass("BarState", ["id", "level", "flag"])
+    self.assertEqual(BarState.storage_dtype(), np.float32)
+
+    BarState.Dtypes = {"id": np.int32, "level": np.int16, "flag": np.uint8}
+    self.assertEqual(BarState.storage_dtype(), np.int32)
+
+    datastore = NumpyDatastore()
+    datastore.register_object_type(
+      "BarState", BarState.State.num_attributes, dtype=BarState.storage_dtype())
+    state = BarState(datastore)
+    state.id.update(2**20)
+    state.level.update(99)
+
+    data = datastore.table("BarState").get([state.datastore_record.id])
+    self.assertEqual(data.dtype, np.int32)
+    np.testing.assert_array_equal(data, np.array([[2**20, 99, 0]]))
+
+    # the schema must cover every attribute
+    BarState.Dtypes = {"id": np.int32}
+    with self.assertRaises(AssertionError):
+      BarState.storage_dtype()
+
 if __name__ == '__main__':
   unittest.main()
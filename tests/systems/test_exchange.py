@@ -75,16 +75,41 @@ class TestExchange(unittest.TestCase):
 
     np.testing.assert_array_equal(
       item.Item.Query.for_sale(realm.datastore)[:,0], [hat_1.id.val, hat_2.id.val])
+    np.testing.assert_array_equal(
+      exchange.for_sale(), item.Item.Query.for_sale(realm.datastore))
 
     # first listing should expire
     exchange.step(10)
     np.testing.assert_array_equal(
       item.Item.Query.for_sale(realm.datastore)[:,0], [hat_2.id.val])
+    np.testing.assert_array_equal(
+      exchange.for_sale(), item.Item.Query.for_sale(realm.datastore))
 
     # second listing should expire
     exchange.step(100)
     np.testing.assert_array_equal(
       item.Item.Query.for_sale(realm.datastore)[:,0], [])
+    np.testing.assert_array_equal(
+      exchange.for_sale(), item.Item.Query.for_sale(realm.datastore))
+
+  def test_for_sale_rows_stay_packed(self):
+    realm = MockRealm()
+    exchange = Exchange(realm)
+    entity_1 = MockEntity()
+
+    hats = [item.Hat(realm, level) for level in range(1, 40)]
+    for hat in hats:
+      exchange._list_item(hat, entity_1, 10, 0)
+
+    # unlist from the middle, re-list and unlist again
+    for hat in hats[5:30:3]:
+      exchange.unlist_item(hat)
+    exchange._list_item(hats[8], entity_1, 20, 1)
+    exchange._list_item(hats[9], entity_1, 20, 1)
+    exchange.unlist_item(hats[0])
+
+    np.testing.assert_array_equal(
+      exchange.for_sale(), item.Item.Query.for_sale(realm.datastore))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import unittest
+
+import os
+import random
+import tempfile
+from tqdm import tqdm
+
+# pylint: disable=import-error
+from testhelpers import ScriptedAgentTestConfig, ScriptedAgentTestEnv
+from testhelpers import observations_are_equal
+
+TEST_HORIZON = 20
+RANDOM_SEED = random.randint(0, 10000)
+
+
+class TestCheckpoint(unittest.TestCase):
+  def test_load_resumes_in_another_env(self):
+    env = ScriptedAgentTestEnv(ScriptedAgentTestConfig())
+    env.reset(seed=RANDOM_SEED)
+    for _ in range(10):
+      env.step({})
+
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'checkpoint')
+      env.save_checkpoint(path)
+      # saving again replaces the checkpoint
+      env.save_checkpoint(path)
+      obs_src = [env.step({})[0] for _ in tqdm(range(TEST_HORIZON))]
+
+      # the loading env generates its own maps, which the checkpoint overrides
+      env_load = ScriptedAgentTestEnv(ScriptedAgentTestConfig())
+      env_load.reset(seed=RANDOM_SEED + 1)
+      env_load.load_checkpoint(path)
+      self.assertEqual(os.listdir(tmp), ['checkpoint'])
+
+    self.assertEqual(env_load.realm.tick, env.realm.tick - TEST_HORIZON)
+    obs_rep = [env_load.step({})[0] for _ in tqdm(range(TEST_HORIZON))]
+    for src, rep in zip(obs_src, obs_rep):
+      self.assertTrue(observations_are_equal(src, rep))
+
+    self.assertListEqual(
+      [[t.material.index for t in row] for row in env.realm.map.tiles],
+      [[t.material.index for t in row] for row in env_load.realm.map.tiles])
+
+if __name__ == '__main__':
+  unittest.main()
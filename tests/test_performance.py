@@ -1,8 +1,11 @@
 
+import tracemalloc
+
 import nmmo
 from nmmo.core.config import (NPC, AllGameSystems, Combat, Communication,
                               Equipment, Exchange, Item, Medium, Profession,
                               Progression, Resource, Small, Terrain)
+from nmmo.entity.entity import Entity
 from scripted import baselines
 
 
@@ -43,6 +46,16 @@ def test_small_env_reset(benchmark):
   env = nmmo.Env(config)
   benchmark(lambda: env.reset(map_id=1))
 
+def test_small_env_restore(benchmark):
+  config = Small()
+  config.PLAYERS = [baselines.Random]
+  env = nmmo.Env(config)
+  env.reset(map_id=1)
+  for _ in range(10):
+    env.step({})
+  snapshot = env.snapshot()
+  benchmark(env.restore, snapshot)
+
 def test_fps_base_small_1_pop(benchmark):
   benchmark_config(benchmark, Small, 1)
 
@@ -100,6 +113,61 @@ def test_fps_no_npc_med_100_pop(benchmark):
 def test_fps_all_med_100_pop(benchmark):
   benchmark_config(benchmark, Medium, 100, AllGameSystems)
 
+# Entity window queries, with and without the spatial index on positions
+def benchmark_window_batch(benchmark, spatial_index):
+  conf = create_config(Medium, AllGameSystems)
+  conf.PLAYER_N = 128
+  conf.DATASTORE_SPATIAL_INDEX = spatial_index
+  conf.PLAYERS = [baselines.Random]
+
+  env = nmmo.Env(conf)
+  env.reset(map_id=1)
+  for _ in range(10):
+    env.step({})
+
+  agents = list(env.realm.players.values())
+  benchmark(Entity.Query.window_batch, env.realm.datastore,
+            [agent.row.val for agent in agents], [agent.col.val for agent in agents],
+            env.config.PLAYER_VISION_RADIUS)
+
+def test_window_batch_med_128_pop(benchmark):
+  benchmark_window_batch(benchmark, False)
+
+def test_window_batch_spatial_index_med_128_pop(benchmark):
+  benchmark_window_batch(benchmark, True)
+
+# Memory regression -- a long episode should not hold on to past ticks
+MEMORY_HORIZON = 1000
+MEMORY_GROWTH_PER_TICK = 64 * 1024
+
+def test_memory_all_small_scripted(benchmark):
+  conf = create_config(Small, AllGameSystems)
+  conf.HORIZON = MEMORY_HORIZON + 100
+  conf.RESOURCE_STARVATION_RATE = 0
+  conf.RESOURCE_DEHYDRATION_RATE = 0
+  conf.SPECIALIZE = True
+  conf.PLAYERS = [
+    baselines.Fisher, baselines.Herbalist, baselines.Prospector, baselines.Carver,
+    baselines.Alchemist, baselines.Melee, baselines.Range, baselines.Mage]
+
+  env = nmmo.Env(conf)
+  env.reset(map_id=1)
+  for _ in range(10):
+    env.step({})
+
+  def run():
+    for _ in range(MEMORY_HORIZON):
+      env.step({})
+
+  tracemalloc.start()
+  start = tracemalloc.get_traced_memory()[0]
+  benchmark.pedantic(run, rounds=1, iterations=1)
+  growth = (tracemalloc.get_traced_memory()[0] - start) / MEMORY_HORIZON
+  tracemalloc.stop()
+
+  benchmark.extra_info['memory_growth_per_tick'] = growth
+  assert growth < MEMORY_GROWTH_PER_TICK, f'Memory grew by {growth:.0f} bytes per tick'
+
 
 '''
 def benchmark_env(benchmark, env, nent):
@@ -0,0 +1,50 @@
+import unittest
+
+import random
+from tqdm import tqdm
+
+# pylint: disable=import-error
+from testhelpers import ScriptedAgentTestConfig, ScriptedAgentTestEnv
+from testhelpers import observations_are_equal
+
+TEST_HORIZON = 20
+RANDOM_SEED = random.randint(0, 10000)
+
+
+def npc_packets(env):
+  return {nid: npc.packet() for nid, npc in env.realm.npcs.items()}
+
+class TestSnapshot(unittest.TestCase):
+  def test_restore_replays_the_branch(self):
+    env = ScriptedAgentTestEnv(ScriptedAgentTestConfig())
+    env.reset(seed=RANDOM_SEED)
+    for _ in range(10):
+      env.step({})
+
+    snapshot = env.snapshot()
+    players = dict(env.realm.players.items())
+    obs_src = [env.step({})[0] for _ in tqdm(range(TEST_HORIZON))]
+    npcs_src = npc_packets(env)
+    tick_src = env.realm.tick
+
+    # a snapshot can be restored any number of times
+    for _ in range(2):
+      env.restore(snapshot)
+      self.assertEqual(env.realm.tick, tick_src - TEST_HORIZON)
+
+      obs_rep = [env.step({})[0] for _ in tqdm(range(TEST_HORIZON))]
+      for src, rep in zip(obs_src, obs_rep):
+        self.assertTrue(observations_are_equal(src, rep))
+      self.assertDictEqual(npcs_src, npc_packets(env))
+
+      # restoring writes the captured state back into the same objects
+      for ent_id, ent in env.realm.players.items():
+        self.assertIs(ent, players[ent_id])
+
+      # tile occupancy follows the restored entities
+      for group in [env.realm.players, env.realm.npcs]:
+        for ent_id, ent in group.items():
+          self.assertIs(env.realm.map.tiles[ent.pos].entities[ent_id], ent)
+
+if __name__ == '__main__':
+  unittest.main()